@@ -0,0 +1,185 @@
+"""JeiLi OTA client, asyncio version
+
+Same protocol as OtaDevice (client.py), but every step is a coroutine so
+that many watches can be driven from a single event loop. Notifications
+received by the BLE stack thread are handed over to the event loop and
+consumed by the coroutines waiting for them.
+"""
+import sys
+import asyncio
+from random import randbytes
+
+from auth import ota_auth
+from frames import FrameDecoder
+from transport import WhadTransport
+
+class AsyncOtaDevice:
+
+    def __init__(self, bdaddr, interface: str = "hci0", transport=None):
+        """Initialize device
+
+        `transport` may be provided to use another BLE transport (e.g. a
+        simulated one) instead of a WHAD central on `interface`.
+        """
+        self.__send = None
+        self.__recv = None
+        self.__bdaddr = bdaddr
+        self.__interface = interface
+        self.__transport = transport
+        self.__connected = False
+        self.__authenticated = False
+
+        # Bound to the running loop on connect()
+        self.__loop = None
+        self.__notifications = None
+        self.__cmd_lock = None
+        self.__decoder = FrameDecoder()
+
+    @property
+    def authenticated(self) -> bool:
+        """Authentication status
+        """
+        return self.__authenticated
+
+    def __connect(self):
+        """Blocking part of connect(), run in an executor
+        """
+        if self.__transport is None:
+            self.__transport = WhadTransport(self.__interface)
+        self.__transport.connect(self.__bdaddr)
+        self.__transport.discover()
+
+    async def connect(self) -> bool:
+        """Connect to specified device
+        """
+        self.__loop = asyncio.get_running_loop()
+        self.__notifications = asyncio.Queue()
+        self.__cmd_lock = asyncio.Lock()
+        try:
+            print(f"Connecting to target device {self.__bdaddr} ...")
+            await self.__loop.run_in_executor(None, self.__connect)
+            self.__connected = True
+            self.__authenticated = False
+
+            # Retrieve our "send" and "recv" characteristics
+            self.__send = self.__transport.characteristic("AE00", "AE01")
+            self.__recv = self.__transport.characteristic("AE00", "AE02")
+            self.__transport.subscribe(self.__recv, self.__on_recv)
+            print(f"Connected to {self.__bdaddr} !")
+            return True
+        except Exception:
+            return False
+
+    def __on_recv(self, characteristic, value, indication):
+        """Called from the BLE stack thread, forward data to the event loop
+        """
+        self.__loop.call_soon_threadsafe(self.__notifications.put_nowait, bytes(value))
+
+    def send_data(self, data: bytes):
+        """Send data to our smartwatch
+        """
+        self.__transport.write_without_response(self.__send, data)
+
+    async def __exchange(self, data: bytes) -> bytes:
+        """Send data and wait for the next notification
+        """
+        self.send_data(data)
+        return await self.__notifications.get()
+
+    async def __authenticate(self) -> bool:
+        # Step 1: send challenge, check the watch response
+        challenge = randbytes(16)
+        value = await self.__exchange(bytes([0x00]) + challenge)
+        if len(value) != 17 or value[0] != 1:
+            print("[step 1] Data received is not a challenge response ! Aborting authentication.")
+            return False
+        if value[1:17] != ota_auth(challenge):
+            self.send_data(bytes([0x02]) + b"fail")
+            print("[!] Authentication failed: rejected by watch")
+            return False
+
+        # Step 2: send auth result, receive the watch challenge
+        value = await self.__exchange(bytes([0x02]) + b"pass")
+        if len(value) != 17 or value[0] != 0:
+            print("[step 2] Data received is not a challenge request ! Aborting authentication.")
+            return False
+
+        # Step 3 & 4: send our response, wait for the watch verdict
+        value = await self.__exchange(bytes([0x01]) + ota_auth(value[1:17]))
+        if len(value) != 5 or value[0] != 2:
+            print("[step 4] Data received is not a challenge request ! Aborting authentication.")
+            return False
+        return value[1:5] == b"pass"
+
+    async def authenticate(self, timeout: float = 10.0) -> bool:
+        """Run the whole authentication process
+        """
+        if not self.__connected:
+            return False
+        try:
+            self.__authenticated = await asyncio.wait_for(self.__authenticate(), timeout)
+        except asyncio.TimeoutError:
+            self.__authenticated = False
+        return self.__authenticated
+
+    async def __read_response(self) -> bytes:
+        """Wait for the next OTA frame, returns its payload
+        """
+        while True:
+            frames = self.__decoder.feed(await self.__notifications.get())
+            if frames:
+                return frames[0].payload
+
+    async def send_ota_cmd(self, command: bytes, timeout: float = 10.0) -> bytes:
+        """Send an OTA command to our watch, returns the response payload
+        or None on timeout
+        """
+        # Make sure we are authenticated
+        if not self.authenticated:
+            return False
+
+        async with self.__cmd_lock:
+            # Drop anything left by a previous, timed out command
+            while not self.__notifications.empty():
+                self.__notifications.get_nowait()
+            self.__decoder.reset()
+
+            self.send_data(command)
+            try:
+                return await asyncio.wait_for(self.__read_response(), timeout)
+            except asyncio.TimeoutError:
+                return None
+
+    async def get_dev_md5(self) -> bytes:
+        """Send a GetDevMD5 command
+
+        fe dc ba c0 d4 00 01 00 ef
+        """
+        return await self.send_ota_cmd(bytes([0xfe, 0xdc, 0xba, 0xc0, 0xd4, 0x00, 0x01, 0x00, 0xef]))
+
+    async def disconnect_classic_bt(self):
+        return await self.send_ota_cmd(bytes([0xfe, 0xdc, 0xba, 0xc0, 0x06,  0x00, 0x01, 0x00, 0xef]))
+
+    async def enter_update_mode(self):
+        return await self.send_ota_cmd(bytes([0xfe, 0xdc, 0xba, 0xc0, 0xe3,  0x00, 0x04, 0x00, 0x00, 0x00, 0x00, 0xef]))
+
+    async def reboot_device(self):
+        return await self.send_ota_cmd(bytes([0xfe, 0xdc, 0xba, 0x20, 0xe1, 0x00, 0x02, 0x00, 0x00, 0xef]))
+
+async def get_md5s(interface: str, bdaddrs):
+    """Connect, authenticate and query the MD5 of several watches at once
+    """
+    async def get_md5(bdaddr):
+        dev = AsyncOtaDevice(bdaddr, interface)
+        if await dev.connect() and await dev.authenticate():
+            return await dev.get_dev_md5()
+        return None
+
+    return await asyncio.gather(*[get_md5(bdaddr) for bdaddr in bdaddrs])
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        for bdaddr, md5 in zip(sys.argv[2:], asyncio.run(get_md5s(sys.argv[1], sys.argv[2:]))):
+            print(f"{bdaddr}: {md5.hex() if md5 is not None else 'failed'}")
+    else:
+        print("Usage: python3 async_client.py <interface> <bdaddr> [<bdaddr> ...]")
@@ -0,0 +1,169 @@
+"""Authentication crypto benchmark suite
+
+Measures the SAFER+ building blocks of h.py and ota_auth(): per-call
+latency percentiles, throughput and memory allocated per call. Results
+can be saved as JSON and compared with the ones of another revision.
+Runs offline, the known-answer vector of auth.py must match first.
+
+Usage: python3 bench_auth.py [-n calls] [-o results.json] [-c baseline.json]
+"""
+import sys
+import json
+import argparse
+import platform
+import tracemalloc
+from random import Random
+from statistics import quantiles
+from time import perf_counter_ns
+
+from constants import EXP_45, LOG_45
+from h import H, H_fast, key_sched, K_to_K_tilda, Ar_rounds, nonlin_subs, _expand_key_cached
+from auth import ota_auth, K, BDADDR
+
+KAT_CHALLENGE = bytes.fromhex("08e1d0bc75aa4ac8343ca6b142105062")
+KAT_RESPONSE = bytes.fromhex("5101b7d2e2b497a23e9232f5aa615962")
+
+SEED = 0x4a4c
+
+
+def ota_auth_ref(challenge: bytes) -> bytes:
+    """ota_auth() as originally implemented, on top of H()
+    """
+    return ota_auth(challenge, trace=True)
+
+def expand_key_uncached(key: bytes):
+    """expand_key() bypassing its LRU
+    """
+    return _expand_key_cached.__wrapped__(key)
+
+def log_scan(values: bytes):
+    """EXP_45 inverse as nonlin_subs() used to compute it
+    """
+    return [EXP_45.index(v) for v in values]
+
+def log_table(values: bytes):
+    """EXP_45 inverse using LOG_45
+    """
+    return [LOG_45[v] for v in values]
+
+def benchmarks():
+    """Returns the benchmarks as a dict of name: (function, argument factory)
+
+    Argument factories take a 16-byte random input.
+    """
+    keys = key_sched(bytearray(K))
+    return {
+        "ota_auth":        (ota_auth, lambda r: r),
+        "ota_auth_ref":    (ota_auth_ref, lambda r: r),
+        "H":               (lambda i: H(bytearray(K), i, bytearray(BDADDR), 6), bytearray),
+        "H_fast":          (lambda i: H_fast(K, i, BDADDR, 6), lambda r: r),
+        "key_sched":       (key_sched, bytearray),
+        "K_to_K_tilda":    (K_to_K_tilda, bytearray),
+        "expand_key":      (expand_key_uncached, lambda r: r),
+        "Ar_rounds":       (lambda i: Ar_rounds(keys, i, is_prime=False), bytearray),
+        "nonlin_subs":     (nonlin_subs, bytearray),
+        "log_scan_16":     (log_scan, lambda r: r),
+        "log_table_16":    (log_table, lambda r: r),
+    }
+
+def check_kat() -> bool:
+    """Correctness gate: known-answer vector, fast and reference paths
+    """
+    return ota_auth(KAT_CHALLENGE) == KAT_RESPONSE \
+        and ota_auth_ref(KAT_CHALLENGE) == KAT_RESPONSE
+
+def run(func, make_arg, calls: int) -> dict:
+    """Benchmark `func` over `calls` random inputs, the same ones whatever
+    the benchmarks run before
+    """
+    rng = Random(SEED)
+    args = [make_arg(rng.randbytes(16)) for _ in range(calls)]
+
+    # Warm up
+    for arg in args[:10]:
+        func(arg)
+
+    # Latency, one sample per call
+    samples = []
+    for arg in args:
+        start = perf_counter_ns()
+        func(arg)
+        samples.append(perf_counter_ns() - start)
+    total = sum(samples)
+    p50, p90, p99 = [quantiles(samples, n=100)[i] for i in (49, 89, 98)]
+
+    # Memory allocated per call (peak traced size), on a subset
+    alloc_calls = min(calls, 50)
+    allocs = []
+    tracemalloc.start()
+    for arg in args[:alloc_calls]:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        func(arg)
+        _, peak = tracemalloc.get_traced_memory()
+        allocs.append(peak - base)
+    tracemalloc.stop()
+
+    return {
+        "calls": calls,
+        "min_us": min(samples) / 1e3,
+        "p50_us": p50 / 1e3,
+        "p90_us": p90 / 1e3,
+        "p99_us": p99 / 1e3,
+        "throughput": calls * 1e9 / total,
+        "alloc_bytes": sorted(allocs)[len(allocs)//2],
+    }
+
+def compare(results: dict, baseline: dict, threshold: float) -> bool:
+    """Print p50 ratios against a baseline, returns False on regression
+    """
+    ok = True
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result["p50_us"] / baseline[name]["p50_us"]
+        regressed = ratio > 1 + threshold
+        ok = ok and not regressed
+        print(f"{name:<16} {ratio:6.2f}x baseline p50{'  REGRESSION' if regressed else ''}")
+    return ok
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the authentication crypto path")
+    parser.add_argument("-n", "--calls", type=int, default=200,
+                        help="calls per benchmark (at least 2)")
+    parser.add_argument("-b", "--bench", action="append", help="only run this benchmark")
+    parser.add_argument("-o", "--output", help="save results as JSON")
+    parser.add_argument("-c", "--compare", help="JSON results to compare with")
+    parser.add_argument("-t", "--threshold", type=float, default=0.10,
+                        help="p50 slowdown reported as a regression (default: 0.10)")
+    args = parser.parse_args()
+    if args.calls < 2:
+        parser.error("at least 2 calls are needed to compute percentiles")
+
+    if not check_kat():
+        print("Known-answer vector mismatch, aborting.")
+        sys.exit(2)
+
+    results = {}
+    print(f"{'benchmark':<16} {'p50 us':>10} {'p90 us':>10} {'p99 us':>10} {'calls/s':>10} {'alloc B':>8}")
+    for name, (func, make_arg) in benchmarks().items():
+        if args.bench and name not in args.bench:
+            continue
+        r = run(func, make_arg, args.calls)
+        results[name] = r
+        print(f"{name:<16} {r['p50_us']:10.1f} {r['p90_us']:10.1f} {r['p99_us']:10.1f} "
+              f"{r['throughput']:10.0f} {r['alloc_bytes']:8d}")
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "seed": SEED,
+                "results": results,
+            }, output, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            if not compare(results, json.load(baseline)["results"], args.threshold):
+                sys.exit(1)
@@ -0,0 +1,82 @@
+"""OTA client round-trip benchmark
+
+Runs OtaDevice against a simulated watch (AE00 service, authentication
+and OTA command responses) that answers after a fixed link latency, and
+reports authentication time and OTA command round-trip times.
+
+Commands are sent one at a time, then pipelined through a window.
+
+With --poll, the client is polled every 100 ms for the authentication
+status and command responses, as it was before waits were notified:
+this gives the baseline figures.
+
+Usage: python3 bench_client.py [-l latency_ms] [-n commands] [-w window] [--poll]
+"""
+import argparse
+from time import perf_counter, sleep
+from statistics import median
+
+from client import OtaDevice
+from simulator import SimulatedTransport
+
+POLL_INTERVAL = 0.1
+
+def poll(predicate, timeout: float = 10.0) -> bool:
+    """Wait for `predicate` to be true, checking it every POLL_INTERVAL
+    """
+    start = perf_counter()
+    while perf_counter() - start < timeout:
+        if predicate():
+            return True
+        sleep(POLL_INTERVAL)
+    return False
+
+def command(dev, polled: bool) -> bytes:
+    """Run a GetDevMD5 command, returns its response
+    """
+    if not polled:
+        return dev.get_dev_md5()
+    future = dev.submit_ota_cmd(0xd4)
+    assert poll(future.done)
+    return future.result()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure OtaDevice round-trip times")
+    parser.add_argument("-l", "--latency", type=float, default=10.0, help="link latency (ms)")
+    parser.add_argument("-n", "--commands", type=int, default=20, help="number of commands")
+    parser.add_argument("-w", "--window", type=int, default=4, help="pipelined commands in flight")
+    parser.add_argument("--poll", action="store_true",
+                        help="poll for responses every 100 ms (baseline)")
+    args = parser.parse_args()
+
+    dev = OtaDevice("00:00:00:00:00:00", transport=SimulatedTransport(latency=args.latency / 1e3),
+                    window=args.window)
+    dev.connect()
+
+    start = perf_counter()
+    dev.authenticate()
+    if args.poll:
+        assert poll(lambda: dev.authenticated)
+    else:
+        assert dev.wait_for_auth()
+    auth_time = perf_counter() - start
+
+    rtts = []
+    for _ in range(args.commands):
+        start = perf_counter()
+        assert command(dev, args.poll) is not None
+        rtts.append(perf_counter() - start)
+
+    start = perf_counter()
+    futures = [dev.submit_ota_cmd(0xd4) for _ in range(args.commands)]
+    for future in futures:
+        if args.poll:
+            assert poll(future.done)
+        future.result()
+    pipelined = perf_counter() - start
+
+    print(f"Link latency     : {args.latency:.1f} ms{' (polling)' if args.poll else ''}")
+    print(f"Authentication   : {auth_time*1e3:.1f} ms")
+    print(f"Command RTT      : median {median(rtts)*1e3:.1f} ms, max {max(rtts)*1e3:.1f} ms")
+    print(f"{args.commands} commands    : {sum(rtts)*1e3:.1f} ms sequential, "
+          f"{pipelined*1e3:.1f} ms pipelined (window {args.window})")
@@ -0,0 +1,36 @@
+"""Startup time benchmark
+
+Measures how long importing a module takes in a fresh interpreter
+(default: auth), over several runs.
+
+Usage: python3 bench_startup.py [-r runs] [module ...]
+"""
+import os
+import sys
+import argparse
+import subprocess
+from statistics import median
+
+SNIPPET = "import time; t = time.perf_counter(); import {}; print(time.perf_counter() - t)"
+
+def import_time(module: str) -> float:
+    """Time spent importing `module` in a new interpreter, in seconds
+    """
+    output = subprocess.check_output(
+        [sys.executable, "-c", SNIPPET.format(module)],
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    return float(output)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure module import time")
+    parser.add_argument("modules", nargs="*", default=["auth"], help="modules to import")
+    parser.add_argument("-r", "--runs", type=int, default=20, help="number of runs")
+    args = parser.parse_args()
+
+    for module in args.modules:
+        # First run also compiles the module, ignore it
+        import_time(module)
+        samples = [import_time(module) for _ in range(args.runs)]
+        print(f"import {module:<12} median {median(samples)*1e3:7.2f} ms  "
+              f"min {min(samples)*1e3:7.2f} ms")
@@ -5,15 +5,13 @@ OTA request
 fe dc ba c0 03 00 06 ff ff ff ff ff 00 ef
 
 """
-from time import time, sleep
 from random import randbytes
-from struct import unpack
-
-from whad.device import WhadDevice
-from whad.ble import Central
-from whad.ble.profile.attribute import UUID
+from threading import Condition
 
 from auth import ota_auth
+from frames import FrameDecoder, FLAG_COMMAND
+from pipeline import CommandPipeline, FLAG_COMMAND_RESP
+from transport import WhadTransport
 
 class OtaDevice:
 
@@ -32,16 +30,33 @@ class OtaDevice:
     STATE_OTA_RESP_RECVD = 3
 
 
-    def __init__(self, bdaddr, interface: str = "hci0"):
+    def __init__(self, bdaddr, interface: str = "hci0", transport=None, window: int = 4,
+                 mtu: int = 23, gatt_cache=None):
         """Initialize device
+
+        `transport` may be provided to use another BLE transport (e.g. a
+        simulated one) instead of a WHAD central on `interface`.
+        `gatt_cache` (GattCache) keeps the discovered GATT profile across
+        connections.
+        `window` is the number of commands submit_ota_cmd() keeps in flight.
+        `mtu` is the ATT MTU requested on connection, data is written in
+        chunks of `mtu` - 3 bytes, `mtu` being updated with the MTU
+        negotiated if the transport supports it (WHAD transports do not,
+        `mtu` must then match the link).
         """
-        self.__periph = None
         self.__send = None
         self.__recv = None
         self.__bdaddr = bdaddr
-        self.__iface = WhadDevice.create(interface)
-        self.__conn = Central(self.__iface)
+        self.mtu = mtu
+        self.__requested_mtu = mtu
+        self.__transport = transport or WhadTransport(interface)
+        self.__transport.set_disconnect_callback(self.__on_disconnect)
+        self.__gatt_cache = gatt_cache
         self.__connected = False
+        self.__disconnect_handlers = []
+
+        # Notified by __on_recv() whenever our states are updated
+        self.__state_changed = Condition()
 
         # Authentication
         self.__auth_state = OtaDevice.STATE_IDLE
@@ -53,9 +68,17 @@ class OtaDevice:
         # OTA Commands
         self.__ota_state = OtaDevice.STATE_OTA_IDLE
         self.__ota_resp = None
-        self.__ota_payload_len = 0
+        self.__ota_decoder = FrameDecoder()
         self.__ota_flag = 0
         self.__ota_opcode = 0
+        self.__pipeline = CommandPipeline(self.send_data, window)
+        self.__cmd_handler = None
+
+    @property
+    def connected(self) -> bool:
+        """Connection status
+        """
+        return self.__connected
 
     @property
     def authenticated(self) -> bool:
@@ -68,39 +91,112 @@ class OtaDevice:
         """
         return randbytes(16)
 
-    def connect(self) -> bool:
+    def __get_characteristics(self):
+        """Retrieve our "send" and "recv" characteristics
+        """
+        self.__send = self.__transport.characteristic("AE00", "AE01")
+        print(f"Send characteristic: {self.__send}")
+        self.__recv = self.__transport.characteristic("AE00", "AE02")
+        print(f"Recv characteristic: {self.__recv}")
+
+    def connect(self, firmware_version: str = None) -> bool:
         """Connect to specified device
+
+        Service discovery is skipped if the GATT cache holds a profile of
+        this device for `firmware_version` (or for any version if None).
         """
         try:
+            # Use the cached GATT profile, if any
+            cached = False
+            if self.__gatt_cache is not None:
+                profile = self.__gatt_cache.get(self.__bdaddr, firmware_version)
+                cached = self.__transport.load_profile(profile) and profile is not None
+
             # Connect to target device
             print(f"Connecting to target device {self.__bdaddr} ...")
-            self.__periph = self.__conn.connect(self.__bdaddr)
+            self.__transport.connect(self.__bdaddr)
             print("Connected !")
             self.__connected = True
+            self.mtu = self.__transport.exchange_mtu(self.__requested_mtu) or self.__requested_mtu
 
-            # Reset authentication state
+            # Reset authentication and OTA states
             self.__auth_state = OtaDevice.STATE_IDLE
-
-            # Discover services and characteristics
-            print("Discovering services and characteristics ...")
-            self.__periph.discover()
-            print("Done !")
-
-            # Retrieve our "send" and "recv" characteristics
-            self.__send = self.__periph.get_characteristic(UUID("AE00"), UUID("AE01"))
-            print(f"Send characteristic: {self.__send}")
-            self.__recv = self.__periph.get_characteristic(UUID("AE00"), UUID("AE02"))
-            print(f"Recv characteristic: {self.__recv}")
+            self.__ota_state = OtaDevice.STATE_OTA_IDLE
+            self.__ota_decoder.reset()
+
+            if cached:
+                try:
+                    self.__get_characteristics()
+                except LookupError:
+                    print("Cached GATT profile is stale")
+                    cached = False
+
+            if not cached:
+                # Discover services and characteristics
+                print("Discovering services and characteristics ...")
+                self.__transport.discover()
+                print("Done !")
+                self.__get_characteristics()
+
+                if self.__gatt_cache is not None:
+                    profile = self.__transport.export_profile()
+                    if profile is not None:
+                        self.__gatt_cache.put(self.__bdaddr, profile, firmware_version)
 
             return True
-        except Exception:
+        except Exception as err:
+            print(f"[!] Connection to {self.__bdaddr} failed: {err!r}")
+            self.__connected = False
             return False
 
+    def disconnect(self):
+        """Close the connection
+        """
+        self.__connected = False
+        self.__transport.disconnect()
+
+    def add_disconnect_handler(self, handler):
+        """Call `handler` (without arguments) when the link is lost
+        """
+        self.__disconnect_handlers.append(handler)
+
+    def remove_disconnect_handler(self, handler):
+        if handler in self.__disconnect_handlers:
+            self.__disconnect_handlers.remove(handler)
+
+    def __on_disconnect(self):
+        """Called by the transport when the link is lost
+        """
+        print(f"[!] Link to {self.__bdaddr} lost")
+        with self.__state_changed:
+            self.__connected = False
+            self.__auth_state = OtaDevice.STATE_IDLE
+            self.__ota_state = OtaDevice.STATE_OTA_IDLE
+            self.__state_changed.notify_all()
+
+        # Fail the commands waiting for a response
+        self.__pipeline.cancel_all()
+        for handler in list(self.__disconnect_handlers):
+            handler()
+
+    def invalidate_gatt_cache(self):
+        """Forget the cached GATT profile (e.g. once the firmware changed)
+        """
+        if self.__gatt_cache is not None:
+            self.__gatt_cache.invalidate(self.__bdaddr)
+
     def __on_recv(self, characteristic, value, indication):
         """Process data sent by the smartwatch
         """
         print(f"[ota] Received data: {value.hex()}")
 
+        with self.__state_changed:
+            self.__process_recv(value)
+            self.__state_changed.notify_all()
+
+    def __process_recv(self, value):
+        """Update our states with data sent by the smartwatch
+        """
         if not self.authenticated:
             if self.__auth_state == OtaDevice.STATE_AUTH_PHONE_CHALL_SENT:
                 # Make sure we received an authentication response from watch
@@ -169,36 +265,44 @@ class OtaDevice:
                     self.__auth_state = OtaDevice.STATE_IDLE
         else:
             # Process OTA response
-            if self.__ota_state == OtaDevice.STATE_OTA_CMD_SENT:
-                if self.__ota_resp is None:
-                    self.__ota_resp = value
-                else:
-                    self.__ota_resp += value
-                
-                if len(self.__ota_resp) >= 7:
-                    magic, self.__ota_flag, self.__ota_opcode, length = unpack(">3sBBH", value[:7])
-                    assert magic == b"\xfe\xdc\xba"
-                    self.__ota_payload_len = length + 1
-                    self.__ota_resp = value[7:]
-                    self.__ota_state = OtaDevice.STATE_OTA_RESP_HEADER
-
-                    if len(self.__ota_resp) >= self.__ota_payload_len:
-                        assert self.__ota_resp[-1] == 0xef
-                        self.__ota_resp = self.__ota_resp[:-1]
-                        self.__ota_state = OtaDevice.STATE_OTA_RESP_RECVD
-
-            elif self.__ota_state == OtaDevice.STATE_OTA_RESP_HEADER:
-                self.__ota_resp += value
-                print(f"[ota] data: {self.__ota_resp.hex()} ({len(self.__ota_resp)}/{self.__ota_payload_len})")
-                if len(self.__ota_resp) >= self.__ota_payload_len:
-                    assert self.__ota_resp[-1] == 0xef
-                    self.__ota_resp = self.__ota_resp[:-1]
+            for frame in self.__ota_decoder.feed(value):
+                if self.__pipeline.on_frame(frame):
+                    # Response to a pipelined command
+                    continue
+                if frame.flag & FLAG_COMMAND and self.__cmd_handler is not None:
+                    # Command sent by the watch
+                    self.__cmd_handler(frame)
+                    continue
+                if self.__ota_state in (OtaDevice.STATE_OTA_CMD_SENT, OtaDevice.STATE_OTA_RESP_HEADER):
+                    self.__ota_flag = frame.flag
+                    self.__ota_opcode = frame.opcode
+                    self.__ota_resp = frame.payload
                     self.__ota_state = OtaDevice.STATE_OTA_RESP_RECVD
+                else:
+                    print(f"[ota] Unexpected frame: {frame}")
+
+            if self.__ota_state == OtaDevice.STATE_OTA_CMD_SENT and self.__ota_decoder.buffered > 0:
+                self.__ota_state = OtaDevice.STATE_OTA_RESP_HEADER
 
     def send_data(self, data: bytes) -> bool:
-        """Send data to our smartwatch
+        """Send data to our smartwatch, split in MTU-sized writes
         """
-        self.__send.write(data, without_response=True)
+        chunk = self.mtu - 3
+        if len(data) <= chunk:
+            self.__transport.write_without_response(self.__send, bytes(data))
+        else:
+            view = memoryview(data)
+            for offset in range(0, len(data), chunk):
+                self.__transport.write_without_response(self.__send, bytes(view[offset:offset + chunk]))
+
+    def set_command_handler(self, handler):
+        """Call `handler` with every command frame sent by the watch
+        (None to ignore them).
+
+        The handler runs in the notification thread and must not wait for
+        another notification.
+        """
+        self.__cmd_handler = handler
 
 
     def authenticate(self) -> bool:
@@ -215,7 +319,7 @@ class OtaDevice:
                 self.__auth_challenge = self.__generate_challenge()
 
                 # Subscribe to a specific characteristic
-                self.__recv.subscribe(callback=self.__on_recv)
+                self.__transport.subscribe(self.__recv, self.__on_recv)
 
                 # Update state
                 self.__auth_state = OtaDevice.STATE_AUTH_PHONE_CHALL_SENT
@@ -277,16 +381,15 @@ class OtaDevice:
 
     def wait_for_auth(self, timeout: float = 10.0) -> bool:
         """Wait for our authentication process to complete.
+
+        Returns as soon as authentication succeeded or was aborted.
         """
-        start = time()
-        while time() - start < timeout:
-            sleep(.1)
-            if self.authenticated:
-                # Success
-                return True
-        
-        # Failed
-        return False
+        with self.__state_changed:
+            self.__state_changed.wait_for(
+                lambda: self.__auth_state in (OtaDevice.STATE_AUTH_WATCH_SUCCEEDED, OtaDevice.STATE_IDLE),
+                timeout
+            )
+            return self.authenticated
 
     def send_ota_cmd(self, command: bytes, timeout: float = 10.0) -> bytes:
         """Send an OTA command to our watch
@@ -295,28 +398,42 @@ class OtaDevice:
         if not self.authenticated:
             return False
         
-        # Update our state
-        self.__ota_state = OtaDevice.STATE_OTA_CMD_SENT
-
-        # Send OTA command to watch
-        self.__ota_resp = None
-        self.__ota_payload_len = 0
-        self.__ota_resp_complete = False
-        self.send_data(command)
-
-        # Wait for a response
-        start = time()
-        while time() - start < timeout:
-            if self.__ota_state == OtaDevice.STATE_OTA_RESP_RECVD:
+        with self.__state_changed:
+            # Update our state
+            self.__ota_state = OtaDevice.STATE_OTA_CMD_SENT
+
+            # Send OTA command to watch
+            self.__ota_resp = None
+            self.__ota_decoder.reset()
+            self.send_data(command)
+
+            # Wait for a response (or a disconnection)
+            if self.__state_changed.wait_for(
+                lambda: self.__ota_state == OtaDevice.STATE_OTA_RESP_RECVD or not self.__connected,
+                timeout
+            ) and self.__connected:
                 # Got a response, send it back
                 print(f"[ota_cmd] Got response: {self.__ota_resp.hex()}")
                 return self.__ota_resp
-            
-            sleep(.1)
-        
-        # Timed out
-        self.__ota_state = OtaDevice.STATE_OTA_IDLE
-        return None
+
+            # Timed out
+            self.__ota_state = OtaDevice.STATE_OTA_IDLE
+            return None
+
+    def submit_ota_cmd(self, opcode: int, params: bytes = b"", flag: int = FLAG_COMMAND_RESP,
+                       callback=None, timeout: float = 10.0):
+        """Send an OTA command without waiting for its response.
+
+        A sequence number is assigned to the command and prepended to
+        `params`. Up to `window` commands can be in flight, this call
+        blocks while the window is full. Returns a concurrent.futures.Future
+        resolved with the response payload, or None if not authenticated.
+
+        Do not mix with send_ota_cmd() while commands are in flight.
+        """
+        if not self.authenticated:
+            return None
+        return self.__pipeline.submit(opcode, params, flag, callback, timeout)
 
     def get_dev_md5(self) -> bytes:
         """Send a GetDevMD5 command
@@ -337,15 +454,14 @@ class OtaDevice:
     def custom_extra_cmd(self):
         return self.send_ota_cmd(bytes([0xfe, 0xdc, 0xba, 0xc0, 0xf0, 0x00, 0x08, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xef]))
 
-dev = OtaDevice("97:ea:e6:b8:a9:b5", "hci1")
-dev.connect()
-dev.authenticate()
-if dev.wait_for_auth():
-    # send OTA command
-    #response = dev.send_ota_cmd(bytes.fromhex("fedcbac0030006ffffffffff00ef"))
-    response = dev.get_dev_md5()
-    #response = dev.custom_extra_cmd()
-    #response = dev.disconnect_classic_bt()
-    print(f"Response: {response.hex()}")
-    
-
+if __name__ == "__main__":
+    dev = OtaDevice("97:ea:e6:b8:a9:b5", "hci1")
+    dev.connect()
+    dev.authenticate()
+    if dev.wait_for_auth():
+        # send OTA command
+        #response = dev.send_ota_cmd(bytes.fromhex("fedcbac0030006ffffffffff00ef"))
+        response = dev.get_dev_md5()
+        #response = dev.custom_extra_cmd()
+        #response = dev.disconnect_classic_bt()
+        print(f"Response: {response.hex()}")
@@ -4,18 +4,34 @@
 """
 constants.py
 
+Importing this module has no side effect: the BitVector module is only
+loaded when one of its names is first accessed here (see __getattr__),
+and logging output is only configured by enable_debug_logging().
+
 """
 
 from binascii import unhexlify, hexlify
-from BitVector import *
 
 import logging
-log = logging.getLogger()
-handler = logging.StreamHandler()
-formatter = logging.Formatter('%(asctime)s %(name)-4s %(levelname)-4s %(message)s')
-handler.setFormatter(formatter)
-log.addHandler(handler)
-# log.setLevel(logging.DEBUG)
+log = logging.getLogger('jieli')
+
+
+def enable_debug_logging():
+    """Print debug messages (H() intermediate values) to stderr."""
+    handler = logging.StreamHandler()
+    formatter = logging.Formatter('%(asctime)s %(name)-4s %(levelname)-4s %(message)s')
+    handler.setFormatter(formatter)
+    log.addHandler(handler)
+    log.setLevel(logging.DEBUG)
+
+
+def __getattr__(name):
+    """Lazily resolves the names previously star-imported from BitVector."""
+    if not name.startswith('_'):
+        import BitVector
+        if hasattr(BitVector, name):
+            return getattr(BitVector, name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
 
 Ar_ROUNDS = 8
 Ar_KEY_LEN = 16  # Bytes, 128 biis
@@ -102,8 +118,43 @@ G2 = [
 ]
 
 
-# NOTE: used for nonlin_subs
+# NOTE: used for nonlin_subs, EXP_45[i] = ((45**i) % 257) % 256
 EXP_45 = []
+e = 1
 for i in range(0, 256):
-    EXP_45.append(int( ((45**i) % 257 ) % 256))
+    EXP_45.append(e % 256)
+    e = (e * 45) % 257
 
+# NOTE: inverse of EXP_45, LOG_45[EXP_45[i]] == i
+LOG_45 = [0] * 256
+for i in range(0, 256):
+    LOG_45[EXP_45[i]] = i
+assert all(EXP_45[LOG_45[i]] == i for i in range(0, 256)), 'EXP_45 is not a permutation'
+del e, i
+
+
+# NOTE: used for rotate, each Byte rotated 3 positions on the left
+ROL3 = bytes(((b << 3) | (b >> 5)) & 0xff for b in range(0, 256))
+
+# NOTE: key schedule biases, B[N][i] = ((45**(45**(17*N+i+1) % 257)) % 257) % 256
+# see h.check_biases()
+BIASES = [
+    None,                                           # not used
+    None,                                           # not used
+    bytes.fromhex("4697b1baa3b7100ac537b3c95a28ac64"),  # B[2]
+    bytes.fromhex("ecabaac66795580df89af66e66dc053d"),  # B[3]
+    bytes.fromhex("8ac3d8896ae9364943bfebd4969b68a0"),  # B[4]
+    bytes.fromhex("5d57921fd5715cbb22c1be7bbc996394"),  # B[5]
+    bytes.fromhex("2a61b8343219fdfb1740e6511d41448f"),  # B[6]
+    bytes.fromhex("dd0480dee731d67f01a2f739da6f23ca"),  # B[7]
+    bytes.fromhex("3ad01cd1303e12a1cd0fe0a8af82592c"),  # B[8]
+    bytes.fromhex("7dadb2efc287ce75061302904f2e7233"),  # B[9]
+    bytes.fromhex("c08dcfa981e2c4272f6c7a9f52e11538"),  # B[10]
+    bytes.fromhex("fc2042c708e409555e8c147660ffdfd7"),  # B[11]
+    bytes.fromhex("fa0b21001af9a6b9e89e624cd99150d2"),  # B[12]
+    bytes.fromhex("18b40784ea5ba4c80ecb48694b4e9c35"),  # B[13]
+    bytes.fromhex("454d54e5253c0c4a8b3fcca7db6baef4"),  # B[14]
+    bytes.fromhex("2df37c6d9db52674f29353b0f011ed83"),  # B[15]
+    bytes.fromhex("b60316733b1e8e70bd861b477e2456f1"),  # B[16]
+    bytes.fromhex("884697b1baa3b7100ac537b3c95a28ac"),  # B[17]
+]
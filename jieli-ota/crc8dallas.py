@@ -0,0 +1,107 @@
+############################################
+# This is for CRC-8 Maxim/Dallas Algorithm
+# Improved with less variable and functions
+# Supports both Python3.x and Python2.x
+# Has append and check functions
+# When standalone, can read from either arguments or stdin
+# Writes to stdout cleaner
+# http://gist.github.com/eaydin
+############################################
+
+import binascii
+import sys
+if sys.version_info[0] == 3:
+    import codecs
+
+def calc(msg: bytes):
+    """CRC-8/Maxim of `msg` (bytes, bytearray or memoryview)"""
+    return update(0, msg)
+
+def update(crc: int, data) -> int:
+    """Returns `crc` updated with `data` (bytes, bytearray or memoryview)"""
+    table = CRC8_TABLE
+    for b in data:
+        crc = table[crc ^ b]
+    return crc
+
+def calc_many(buffer, size: int) -> bytes:
+    """CRC-8 of each `size`-byte frame of `buffer` (whose length must be a
+    multiple of `size`), one byte per frame.
+
+    Frames are processed column by column: one translate() over all frames
+    per byte position, instead of one table lookup per byte."""
+    buffer = bytes(buffer)
+    assert len(buffer) % size == 0
+    count = len(buffer) // size
+    crcs = 0
+    for i in range(size):
+        column = int.from_bytes(buffer[i::size], "big")
+        crcs = int.from_bytes((crcs ^ column).to_bytes(count, "big").translate(CRC8_TABLE), "big")
+    return crcs.to_bytes(count, "big")
+
+def calc_bitwise(msg: bytes):
+    """Reference implementation, 8 shift/xor per byte"""
+    check = 0
+    for i in msg:
+        check = AddToCRC(i, check)
+    return check
+
+def AddToCRC(b, crc):
+    if (b < 0):
+        b += 256
+    for i in range(8):
+        odd = ((b^crc) & 1) == 1
+        crc >>= 1
+        b >>= 1
+        if (odd):
+            crc ^= 0x8C # this means crc ^= 140
+    return crc
+
+# CRC of every byte value, the CRC is reflected so that processing byte b
+# with register crc is the same as processing b ^ crc from 0
+CRC8_TABLE = bytes(AddToCRC(i, 0) for i in range(256))
+
+def check_table(rounds: int = 1000):
+    """Compare the table-driven CRC with the bitwise one on random data"""
+    from random import randbytes, randrange
+    for _ in range(rounds):
+        msg = randbytes(randrange(64))
+        if calc(msg) != calc_bitwise(msg) or calc(memoryview(msg)) != calc_bitwise(msg):
+            return False
+    frames = randbytes(20 * 100)
+    return calc_many(frames, 20) == bytes(calc_bitwise(frames[20*i:20*(i+1)]) for i in range(100))
+
+def check(incoming):
+    """Returns True if the CRC of the message with its CRC appended is 0"""
+    return calc(incoming) == 0
+
+def append(incoming):
+    """Returns the Incoming message after appending it's CRC CheckSum"""
+    return bytes(incoming) + bytes([calc(incoming)])
+
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1 and sys.argv[1] == "-t":
+        assert check_table()
+        print("CRC table: OK")
+        sys.exit(0)
+
+    if not sys.stdin.isatty():
+        # there's something in stdin
+        msg = sys.stdin.read().strip()
+        if msg == "":
+            print("No data input. Either provide by stdin or arguments")
+            sys.exit(1)
+    elif len(sys.argv) > 1:
+        msg = sys.argv[1]
+    else:
+        print("No data input. Either provide by stdin or arguments")
+        sys.exit(1)
+
+    try:
+        # Message given in hex
+        sys.stdout.write("{0:02x}\n".format(calc(bytes.fromhex(msg))))
+        sys.exit(0)
+    except Exception as err:
+        print("An Error Occured: {0}".format(err))
+        sys.exit(1)
\ No newline at end of file
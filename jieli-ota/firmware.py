@@ -0,0 +1,187 @@
+"""JieLi OTA firmware update
+
+1. read the firmware header offset/length from the watch (E1)
+2. send that header to check the watch accepts the image (E2)
+3. enter update mode (E3)
+4. serve the blocks requested by the watch (E5, offset and length), until
+   it requests an empty block
+5. query the update result (E6) and reboot the watch (E7)
+
+Blocks are written in chunks of the ATT MTU negotiated on connection
+(see OtaDevice.mtu), or of the MTU given on the command line if the
+transport cannot negotiate it (WHAD).
+
+If the link is lost, run() raises ConnectionError; once reconnected and
+authenticated, run(resume=True) enters update mode again and the watch
+requests the block it was waiting for (see session.py).
+
+Usage: python3 firmware.py <bdaddr> <interface> <firmware file> [mtu]
+"""
+import sys
+import mmap
+from struct import unpack_from
+from threading import Event
+from time import perf_counter
+
+from frames import MAGIC, TRAILER
+
+OPCODE_GET_FILE_INFO_OFFSET = 0xe1
+OPCODE_INQUIRE_CAN_UPDATE = 0xe2
+OPCODE_ENTER_UPDATE_MODE = 0xe3
+OPCODE_SEND_FIRMWARE_BLOCK = 0xe5
+OPCODE_GET_REFRESH_STATUS = 0xe6
+OPCODE_REBOOT = 0xe7
+
+class FirmwareUpdateError(Exception):
+    pass
+
+class FirmwareUpdater:
+
+    def __init__(self, device, path: str, progress=None):
+        """Initialize updater for an authenticated OtaDevice
+
+        `progress`, if given, is called with (bytes sent, image size,
+        throughput in bytes/s, ETA in seconds) after each block.
+        """
+        self.__device = device
+        self.__path = path
+        self.__progress = progress or self.print_progress
+        self.__image = None
+        self.__done = Event()
+        self.__error = None
+        self.__frame = bytearray()
+        self.__start = None
+        self.sent = 0
+        self.acknowledged = 0
+
+    @staticmethod
+    def print_progress(sent: int, size: int, throughput: float, eta: float):
+        print(f"[fw] {sent}/{size} bytes, {throughput/1024:.1f} kB/s, ETA {eta:.0f}s")
+
+    def __command(self, opcode: int, params: bytes = b"", timeout: float = 10.0) -> bytes:
+        """Run a command, returns the response data (after status and
+        sequence number)
+        """
+        future = self.__device.submit_ota_cmd(opcode, params, timeout=timeout)
+        if future is None:
+            if not self.__device.connected:
+                raise ConnectionError("device is not connected")
+            raise FirmwareUpdateError("device is not authenticated")
+        response = future.result()
+        if response[0] != 0:
+            raise FirmwareUpdateError(f"command {opcode:02x} failed with status {response[0]}")
+        return response[2:]
+
+    def __send_block(self, sequence: int, offset: int, length: int):
+        """Answer a block request, straight out of the mapped image
+        """
+        # Response frame: header, status, sequence number, data, trailer
+        size = 7 + 2 + length + 1
+        if len(self.__frame) < size:
+            self.__frame = bytearray(size)
+        frame = memoryview(self.__frame)[:size]
+        frame[:3] = MAGIC
+        frame[3:7] = bytes([0x00, OPCODE_SEND_FIRMWARE_BLOCK, (length + 2) >> 8, (length + 2) & 0xff])
+        frame[7:9] = bytes([0x00, sequence])
+        frame[9:9 + length] = self.__image[offset:offset + length]
+        frame[9 + length] = TRAILER
+        self.__device.send_data(frame)
+
+    def __fail(self, error: Exception):
+        self.__error = error
+        self.__done.set()
+
+    def __on_disconnect(self):
+        self.__fail(ConnectionError("link lost during transfer"))
+
+    def __on_command(self, frame):
+        """Commands sent by the watch during the transfer
+        """
+        if frame.opcode != OPCODE_SEND_FIRMWARE_BLOCK:
+            return
+        offset, length = unpack_from(">IH", frame.payload, 1)
+        try:
+            if offset == 0 and length == 0:
+                # Transfer complete
+                self.__send_block(frame.sequence, 0, 0)
+                self.acknowledged = len(self.__image)
+                self.__done.set()
+                return
+            if offset + length > len(self.__image):
+                self.__fail(FirmwareUpdateError(f"block {offset}+{length} out of image"))
+                return
+
+            # The watch asks for the block following the ones it received
+            self.acknowledged = offset
+            self.__send_block(frame.sequence, offset, length)
+        except ConnectionError as err:
+            self.__fail(err)
+            return
+        self.sent = max(self.sent, offset + length)
+        elapsed = perf_counter() - self.__start
+        throughput = self.sent / elapsed if elapsed > 0 else 0.0
+        eta = (len(self.__image) - self.sent) / throughput if throughput > 0 else 0.0
+        self.__progress(self.sent, len(self.__image), throughput, max(eta, 0.0))
+
+    def run(self, timeout: float = 300.0, reboot: bool = True, resume: bool = False) -> float:
+        """Update the watch firmware, returns the average throughput
+        (bytes/s). Raises FirmwareUpdateError on failure, ConnectionError
+        if the link is lost.
+
+        With `resume`, continue an interrupted update: the throughput
+        covers the whole update, reconnections included.
+        """
+        with open(self.__path, "rb") as firmware, \
+             mmap.mmap(firmware.fileno(), 0, access=mmap.ACCESS_READ) as image:
+            self.__image = image
+            self.__done.clear()
+            self.__error = None
+            if not resume:
+                self.sent = 0
+                self.acknowledged = 0
+                self.__start = None
+            self.__device.set_command_handler(self.__on_command)
+            self.__device.add_disconnect_handler(self.__on_disconnect)
+            try:
+                # Check the watch accepts this image
+                offset, length = unpack_from(">IH", self.__command(OPCODE_GET_FILE_INFO_OFFSET))
+                if self.__command(OPCODE_INQUIRE_CAN_UPDATE, image[offset:offset + length])[0] != 0:
+                    raise FirmwareUpdateError("firmware rejected by the watch")
+
+                # Transfer
+                if self.__start is None:
+                    self.__start = perf_counter()
+                if self.__command(OPCODE_ENTER_UPDATE_MODE, bytes(3))[0] != 0:
+                    raise FirmwareUpdateError("watch refused to enter update mode")
+                if not self.__done.wait(timeout):
+                    raise FirmwareUpdateError("transfer timed out")
+                if self.__error is not None:
+                    raise self.__error
+                elapsed = perf_counter() - self.__start
+
+                # Result
+                if self.__command(OPCODE_GET_REFRESH_STATUS)[0] != 0:
+                    raise FirmwareUpdateError("firmware update failed")
+                self.__device.invalidate_gatt_cache()
+                if reboot:
+                    self.__command(OPCODE_REBOOT, bytes([0]))
+            finally:
+                self.__device.set_command_handler(None)
+                self.__device.remove_disconnect_handler(self.__on_disconnect)
+                self.__image = None
+
+        return self.sent / elapsed if elapsed > 0 else 0.0
+
+if __name__ == "__main__":
+    if len(sys.argv) > 3:
+        from client import OtaDevice
+
+        mtu = int(sys.argv[4]) if len(sys.argv) > 4 else 23
+        dev = OtaDevice(sys.argv[1], sys.argv[2], mtu=mtu)
+        dev.connect()
+        dev.authenticate()
+        if dev.wait_for_auth():
+            throughput = FirmwareUpdater(dev, sys.argv[3]).run()
+            print(f"Firmware updated ({throughput/1024:.1f} kB/s)")
+    else:
+        print("Usage: python3 firmware.py <bdaddr> <interface> <firmware file> [mtu]")
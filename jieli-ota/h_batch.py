@@ -0,0 +1,84 @@
+"""
+h_batch.py
+
+NumPy version of H_fast() computing Out for many inputs at once.
+
+Inputs are (N, 16) uint8 arrays, one row per I_one. Every SAFER+ step
+of h.py is applied column-wise on the whole array, uint8 arithmetic
+giving the mod 256 additions for free. Requires numpy.
+
+"""
+import numpy as np
+
+from constants import *
+from h import expand_key
+
+_EXP_45 = np.array(EXP_45, dtype=np.uint8)
+_LOG_45 = np.array(LOG_45, dtype=np.uint8)
+
+# NOTE: Bytes combined with XOR by add_one (and with + by add_two)
+_XOR_BYTES = np.array([i % 4 in (0, 3) for i in range(16)])
+
+# NOTE: Armenian permutation, see PERMUTE()
+_PERMUTE = np.array([8, 11, 12, 15, 2, 1, 6, 5, 10, 9, 14, 13, 0, 7, 4, 3])
+
+
+def _add_one(x, k):
+    return np.where(_XOR_BYTES, x ^ k, x + k)
+
+
+def _add_two(x, k):
+    return np.where(_XOR_BYTES, x + k, x ^ k)
+
+
+def _nonlin_subs(x):
+    return np.where(_XOR_BYTES, _EXP_45[x], _LOG_45[x])
+
+
+def _PHTs(x):
+    rv = np.empty_like(x)
+    rv[:, 1::2] = x[:, 0::2] + x[:, 1::2]
+    rv[:, 0::2] = x[:, 0::2] + rv[:, 1::2]
+    return rv
+
+
+def _ar_batch(keys, inp, is_prime):
+    """Same as Ar_rounds(...)[10] for every row of inp."""
+    keys = np.array(keys, dtype=np.uint8)
+    x = inp
+
+    for r in range(8):
+        # NOTE: input of round1 is add_one to input of round3
+        if is_prime and r == 2:
+            x = _add_one(x, inp)
+
+        x = _add_two(_nonlin_subs(_add_one(x, keys[2*r])), keys[2*r + 1])
+        x = _PHTs(x)
+        for _ in range(3):
+            x = _PHTs(x[:, _PERMUTE])
+
+    return _add_one(x, keys[16])
+
+
+def H_batch(K, I_one, I_two, L):
+    """Returns Out of H(K, I_one[n], I_two, L) for every row n of I_one.
+
+    I_one is a (N, 16) uint8 array, I_two is either L bytes shared by all
+    rows or a (N, L) array. Returns a (N, 16) uint8 array.
+    """
+    I_one = np.asarray(I_one, dtype=np.uint8)
+    if not isinstance(I_two, np.ndarray):
+        I_two = np.frombuffer(bytes(I_two), dtype=np.uint8)
+    I_two = I_two.astype(np.uint8, copy=False)
+    assert I_one.ndim == 2 and I_one.shape[1] == Ar_KEY_LEN
+    assert I_two.shape[-1] == L and (L == COF_LEN or L == BTADD_LEN)
+
+    Keys, KeysPrime = expand_key(K)
+
+    # NOTE: E(I_two, L)
+    I_two_ext = I_two[..., [i % L for i in range(16)]]
+
+    Ar = _ar_batch(Keys, I_one, is_prime=False)
+    ar_prime_inp = (Ar ^ I_one) + I_two_ext
+
+    return _ar_batch(KeysPrime, ar_prime_inp, is_prime=True)
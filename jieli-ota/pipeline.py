@@ -0,0 +1,102 @@
+"""JieLi OTA command pipeline
+
+Keeps up to `window` commands in flight and matches every response to
+its command by opcode and sequence number, so that independent commands
+do not each wait for the previous response.
+"""
+from threading import Lock, Semaphore, Timer
+from concurrent.futures import Future
+
+from frames import build_frame, FLAG_COMMAND
+
+# Command expecting a response
+FLAG_COMMAND_RESP = 0xc0
+
+class CommandPipeline:
+
+    def __init__(self, send, window: int = 4, timeout: float = 10.0):
+        """Initialize pipeline
+
+        `send` is called with every frame to transmit, `timeout` is the
+        default time a command waits for its response. `window` is at most
+        256, the number of distinct sequence numbers.
+        """
+        self.__send = send
+        self.__window = Semaphore(min(window, 256))
+        self.__timeout = timeout
+        self.__lock = Lock()
+        self.__pending = {}
+        self.__sequence = 0
+
+    @property
+    def in_flight(self) -> int:
+        """Number of commands waiting for their response
+        """
+        return len(self.__pending)
+
+    def submit(self, opcode: int, params: bytes = b"", flag: int = FLAG_COMMAND_RESP,
+               callback=None, timeout: float = None) -> Future:
+        """Send a command, blocking while the window is full.
+
+        The returned future is resolved with the response payload (status,
+        sequence number and data), or fails with TimeoutError (or the
+        error raised by `send`, e.g. ConnectionError). `callback`,
+        if given, is called with the future once it is done.
+        """
+        timeout = self.__timeout if timeout is None else timeout
+        future = Future()
+        if callback is not None:
+            future.add_done_callback(callback)
+
+        if not self.__window.acquire(timeout=timeout):
+            future.set_exception(TimeoutError("command window full"))
+            return future
+
+        with self.__lock:
+            sequence = self.__sequence
+            self.__sequence = (self.__sequence + 1) & 0xff
+            key = (opcode, sequence)
+            timer = Timer(timeout, self.__expire, (key,))
+            timer.daemon = True
+            self.__pending[key] = (future, timer)
+        timer.start()
+
+        try:
+            self.__send(build_frame(flag, opcode, bytes([sequence]) + bytes(params)))
+        except Exception as err:
+            # Not sent (e.g. link lost), free its window slot
+            self.__complete(key, exception=err)
+        return future
+
+    def __complete(self, key, result=None, exception=None) -> bool:
+        with self.__lock:
+            entry = self.__pending.pop(key, None)
+        if entry is None:
+            return False
+        future, timer = entry
+        timer.cancel()
+        self.__window.release()
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+        return True
+
+    def __expire(self, key):
+        self.__complete(key, exception=TimeoutError(f"no response to command {key[0]:02x} #{key[1]}"))
+
+    def on_frame(self, frame) -> bool:
+        """Process a received frame, returns True if it answered one of
+        our pending commands
+        """
+        if frame.flag & FLAG_COMMAND or frame.sequence is None:
+            return False
+        return self.__complete((frame.opcode, frame.sequence), result=frame.payload)
+
+    def cancel_all(self):
+        """Fail every pending command (e.g. on disconnection)
+        """
+        with self.__lock:
+            keys = list(self.__pending)
+        for key in keys:
+            self.__complete(key, exception=ConnectionError("command cancelled"))
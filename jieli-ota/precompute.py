@@ -0,0 +1,89 @@
+"""JeiLi OTA challenge/response precomputation
+
+Generates random challenges and their expected responses (see ota_auth)
+on all cores, and streams them to a binary file. Each record is 32 bytes
+long: challenge (16 bytes) followed by the response (16 bytes).
+
+Usage: python3 precompute.py <output file> <count> [-j <processes>]
+"""
+import os
+import fcntl
+import argparse
+from time import perf_counter
+from multiprocessing import Pool, cpu_count
+
+from auth import ota_auth
+
+RECORD_SIZE = 32
+CHUNK_RECORDS = 1024
+
+def compute_chunk(count: int):
+    """Compute `count` records, returns the records and the time spent.
+    """
+    start = perf_counter()
+    records = bytearray(count * RECORD_SIZE)
+    challenges = os.urandom(count * 16)
+    for i in range(count):
+        challenge = challenges[16*i:16*(i+1)]
+        records[RECORD_SIZE*i:RECORD_SIZE*i + 16] = challenge
+        records[RECORD_SIZE*i + 16:RECORD_SIZE*(i+1)] = ota_auth(challenge)
+    return bytes(records), perf_counter() - start
+
+def precompute(path: str, count: int, processes: int = None, chunk: int = CHUNK_RECORDS):
+    """Write `count` records to `path` using a pool of `processes` workers.
+
+    Returns the total wall time and the cumulated worker time.
+    """
+    processes = processes or cpu_count()
+    chunks = [chunk] * (count // chunk)
+    if count % chunk:
+        chunks.append(count % chunk)
+
+    start = perf_counter()
+    busy = 0.0
+    with open(path, "wb") as output, Pool(processes) as pool:
+        for records, elapsed in pool.imap_unordered(compute_chunk, chunks):
+            output.write(records)
+            busy += elapsed
+    return perf_counter() - start, busy
+
+def read_records(path: str):
+    """Iterate over the (challenge, response) records stored in `path`
+    """
+    with open(path, "rb") as table:
+        while True:
+            record = table.read(RECORD_SIZE)
+            if len(record) < RECORD_SIZE:
+                return
+            yield record[:16], record[16:]
+
+def pop_record(path: str):
+    """Remove the last record from `path` and return it as a
+    (challenge, response) tuple, or None if the table is empty.
+
+    The table is locked meanwhile, so that clients sharing it (even from
+    other processes) never pop the same challenge twice.
+    """
+    with open(path, "r+b") as table:
+        fcntl.flock(table, fcntl.LOCK_EX)
+        size = table.seek(0, os.SEEK_END)
+        size -= size % RECORD_SIZE
+        if size == 0:
+            return None
+        table.seek(size - RECORD_SIZE)
+        record = table.read(RECORD_SIZE)
+        table.truncate(size - RECORD_SIZE)
+    return record[:16], record[16:]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute OTA challenge/response pairs")
+    parser.add_argument("output", help="output file")
+    parser.add_argument("count", type=int, help="number of records")
+    parser.add_argument("-j", "--processes", type=int, default=cpu_count(),
+                        help="number of worker processes (default: all cores)")
+    args = parser.parse_args()
+
+    wall, busy = precompute(args.output, args.count, args.processes)
+    print(f"{args.count} records written to {args.output} in {wall:.2f}s")
+    print(f"Throughput: {args.count/wall:.0f} records/s with {args.processes} processes")
+    print(f"Per core  : {args.count/busy:.0f} records/s")
@@ -0,0 +1,159 @@
+"""Multi-watch provisioning
+
+Connects to many watches in parallel, authenticates and updates their
+firmware (or only queries their MD5 if no firmware is given), verifying
+the update status reported by each watch.
+
+Every adapter (hci0, hci1, ...) holds at most one connection at a time:
+one worker per adapter takes the next pending watch from a shared queue
+as soon as it is done with the previous one, so faster adapters end up
+serving more watches.
+
+Usage: python3 provision.py -i hci0 -i hci1 [-f firmware] [-m mtu] <bdaddr> [<bdaddr> ...]
+       python3 provision.py -s 4 [-l latency_ms] [-f firmware] <bdaddr> [<bdaddr> ...]
+"""
+import os
+import argparse
+from collections import namedtuple
+from queue import Queue, Empty
+from threading import Thread, Lock
+from time import perf_counter
+
+from client import OtaDevice
+from firmware import FirmwareUpdater
+
+DeviceResult = namedtuple("DeviceResult", [
+    "bdaddr", "adapter", "ok", "connect", "auth", "transfer", "total", "size", "error"
+])
+
+class Provisioner:
+
+    def __init__(self, adapters, transport_factory=None, firmware: str = None, mtu: int = 23,
+                 gatt_cache=None):
+        """Initialize provisioner
+
+        `adapters` are the names of the interfaces to use, `transport_factory`
+        is called with an adapter name and returns the transport used on it
+        (a WHAD transport by default). Watches are updated with `firmware`
+        if given.
+        """
+        self.__adapters = list(adapters)
+        self.__transport_factory = transport_factory
+        self.__firmware = firmware
+        self.__mtu = mtu
+        self.__gatt_cache = gatt_cache
+        self.__lock = Lock()
+        self.results = []
+
+    def __provision(self, adapter: str, transport, bdaddr: str) -> DeviceResult:
+        timings = {"connect": 0.0, "auth": 0.0, "transfer": 0.0}
+        size = 0
+        error = None
+        start = perf_counter()
+        step = start
+        try:
+            dev = OtaDevice(bdaddr, adapter, transport=transport, mtu=self.__mtu,
+                            gatt_cache=self.__gatt_cache)
+            if not dev.connect():
+                raise ConnectionError("connection failed")
+            timings["connect"] = perf_counter() - step
+
+            step = perf_counter()
+            dev.authenticate()
+            if not dev.wait_for_auth():
+                raise ConnectionError("authentication failed")
+            timings["auth"] = perf_counter() - step
+
+            step = perf_counter()
+            if self.__firmware is not None:
+                FirmwareUpdater(dev, self.__firmware, progress=lambda *args: None).run()
+                size = os.path.getsize(self.__firmware)
+            elif dev.get_dev_md5() is None:
+                raise ConnectionError("no MD5 received")
+            timings["transfer"] = perf_counter() - step
+        except Exception as err:
+            # One failing watch must not stop its adapter
+            error = f"{type(err).__name__}: {err}"
+        finally:
+            transport.disconnect()
+
+        return DeviceResult(bdaddr, adapter, error is None, timings["connect"], timings["auth"],
+                            timings["transfer"], perf_counter() - start, size, error)
+
+    def __worker(self, adapter: str, pending: Queue):
+        transport = None
+        if self.__transport_factory is not None:
+            transport = self.__transport_factory(adapter)
+        else:
+            from transport import WhadTransport
+            transport = WhadTransport(adapter)
+
+        while True:
+            try:
+                bdaddr = pending.get_nowait()
+            except Empty:
+                return
+            result = self.__provision(adapter, transport, bdaddr)
+            with self.__lock:
+                self.results.append(result)
+
+    def run(self, bdaddrs) -> float:
+        """Provision all `bdaddrs`, returns the elapsed time. Per-device
+        results are stored in `results`.
+        """
+        pending = Queue()
+        for bdaddr in bdaddrs:
+            pending.put(bdaddr)
+        self.results = []
+
+        start = perf_counter()
+        workers = [Thread(target=self.__worker, args=(adapter, pending))
+                   for adapter in self.__adapters[:len(bdaddrs)]]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return perf_counter() - start
+
+    def report(self, elapsed: float):
+        """Print per-device timings and aggregate throughput
+        """
+        print(f"{'device':<18} {'adapter':<8} {'connect':>8} {'auth':>8} {'transfer':>9} {'total':>8}  result")
+        for r in sorted(self.results, key=lambda r: r.bdaddr):
+            print(f"{r.bdaddr:<18} {r.adapter:<8} {r.connect:>7.2f}s {r.auth:>7.2f}s "
+                  f"{r.transfer:>8.2f}s {r.total:>7.2f}s  {'OK' if r.ok else r.error}")
+        succeeded = [r for r in self.results if r.ok]
+        size = sum(r.size for r in succeeded)
+        print(f"{len(succeeded)}/{len(self.results)} watches provisioned in {elapsed:.2f}s "
+              f"on {min(len(self.__adapters), len(self.results))} adapters, "
+              f"{size/elapsed/1024:.1f} kB/s aggregate, "
+              f"{len(succeeded)/elapsed*60:.1f} watches/min")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Provision several watches in parallel")
+    parser.add_argument("bdaddrs", nargs="+", help="watch BD addresses")
+    parser.add_argument("-i", "--interface", action="append", help="adapter to use (repeatable)")
+    parser.add_argument("-f", "--firmware", help="firmware image to install")
+    parser.add_argument("-m", "--mtu", type=int, default=23, help="ATT MTU")
+    parser.add_argument("-s", "--simulate", type=int, metavar="ADAPTERS",
+                        help="use simulated adapters and watches")
+    parser.add_argument("-l", "--latency", type=float, default=10.0,
+                        help="simulated link latency (ms)")
+    args = parser.parse_args()
+
+    factory = None
+    adapters = args.interface or ["hci0"]
+    if args.simulate:
+        from simulator import SimulatedTransport
+
+        firmware = None
+        if args.firmware is not None:
+            with open(args.firmware, "rb") as image:
+                firmware = image.read()
+        adapters = [f"sim{i}" for i in range(args.simulate)]
+        factory = lambda adapter: SimulatedTransport(latency=args.latency / 1e3, mtu=args.mtu,
+                                                      firmware=firmware)
+
+    provisioner = Provisioner(adapters, factory, args.firmware, args.mtu)
+    elapsed = provisioner.run(args.bdaddrs)
+    provisioner.report(elapsed)
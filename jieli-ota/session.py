@@ -0,0 +1,110 @@
+"""Resumable OTA session
+
+Wraps an OtaDevice so that a lost link does not end the session: the
+device is reconnected with exponential backoff and authenticated again,
+then the interrupted operation is run again. Firmware updates resume
+from the last block acknowledged by the watch instead of restarting.
+
+Usage: python3 session.py <bdaddr> <interface> <firmware file> [mtu]
+"""
+import sys
+from threading import Event
+from time import sleep
+
+from firmware import FirmwareUpdater
+
+class OtaSession:
+
+    def __init__(self, device, retries: int = 5, backoff: float = 0.5, max_backoff: float = 30.0):
+        """Initialize session on `device` (OtaDevice)
+
+        Every operation is attempted `retries` + 1 times at most. Before
+        each reconnection attempt, the session waits `backoff` seconds,
+        doubled after every failed attempt up to `max_backoff`.
+        """
+        self.device = device
+        self.__retries = retries
+        self.__backoff = backoff
+        self.__max_backoff = max_backoff
+        self.__link_lost = Event()
+        self.reconnections = 0
+        device.add_disconnect_handler(self.__link_lost.set)
+
+    def __establish(self) -> bool:
+        """Connect and authenticate, retrying with exponential backoff
+        """
+        delay = self.__backoff
+        for attempt in range(self.__retries + 1):
+            if attempt > 0:
+                print(f"[session] Retrying in {delay:.1f}s ({attempt}/{self.__retries})")
+                sleep(delay)
+                delay = min(delay * 2, self.__max_backoff)
+            self.__link_lost.clear()
+            if self.device.connect():
+                self.device.authenticate()
+                if self.device.wait_for_auth():
+                    return True
+        return False
+
+    def open(self) -> bool:
+        """Connect to the device and authenticate
+        """
+        return self.__establish()
+
+    def close(self):
+        self.device.disconnect()
+
+    def ensure(self) -> bool:
+        """Make sure the device is connected and authenticated,
+        reconnecting if the link was lost
+        """
+        if self.device.connected and self.device.authenticated and not self.__link_lost.is_set():
+            return True
+        print("[session] Link lost, reconnecting ...")
+        self.reconnections += 1
+        return self.__establish()
+
+    def call(self, operation):
+        """Run `operation` with the device, returns its result. If the link
+        is lost meanwhile, reconnect and run it again.
+
+        `operation` may raise ConnectionError when the link is lost.
+        """
+        for _ in range(self.__retries + 1):
+            if not self.ensure():
+                break
+            try:
+                result = operation(self.device)
+            except ConnectionError as err:
+                print(f"[session] {err}")
+                continue
+            if not self.__link_lost.is_set():
+                return result
+        raise ConnectionError(f"session lost after {self.reconnections} reconnections")
+
+    def update_firmware(self, path: str, progress=None, timeout: float = 300.0) -> float:
+        """Update the watch firmware, resuming the transfer after each
+        reconnection. Returns the average throughput (bytes/s).
+        """
+        updater = FirmwareUpdater(self.device, path, progress)
+        started = []
+
+        def run(device):
+            resume = bool(started)
+            started.append(True)
+            return updater.run(timeout, resume=resume)
+
+        return self.call(run)
+
+if __name__ == "__main__":
+    if len(sys.argv) > 3:
+        from client import OtaDevice
+
+        mtu = int(sys.argv[4]) if len(sys.argv) > 4 else 23
+        session = OtaSession(OtaDevice(sys.argv[1], sys.argv[2], mtu=mtu))
+        if session.open():
+            throughput = session.update_firmware(sys.argv[3])
+            print(f"Firmware updated ({throughput/1024:.1f} kB/s, "
+                  f"{session.reconnections} reconnections)")
+    else:
+        print("Usage: python3 session.py <bdaddr> <interface> <firmware file> [mtu]")
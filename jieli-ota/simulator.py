@@ -0,0 +1,415 @@
+"""Simulated JieLi watch
+
+In-process stand-in for the watch and its BLE link, exposing the same
+central / peripheral / characteristic calls as WHAD, and used by clients
+through SimulatedTransport. It emulates:
+
+* the AE00 service: authentication handshake, OTA commands and the
+  firmware update bootloader
+* the 18D0 Lefun service: watch face upload (size, 16-byte chunks),
+  acknowledged every `ack_interval` chunks (never if 0, like older
+  watches)
+
+Services must be discovered (which takes `discovery_time` seconds) or
+loaded from a profile exported for the same firmware `version` before
+characteristics can be looked up.
+
+Notifications are delivered in order by a dedicated thread, `latency`
+seconds after the write that triggered them. drop_link() simulates a
+link loss: pending notifications are discarded, writes fail until the
+central reconnects, and the bootloader resumes from the block it was
+waiting for. Writes larger than
+`mtu` - 3 bytes are rejected (`mtu` is also the largest MTU the watch
+accepts in an MTU exchange), and upload chunks (Lefun writes without
+response) are dropped with probability `loss`.
+
+Lefun frames are ab <length> <command> <data> <crc8>, upload chunks are
+ab 29 <index (2 bytes)> <16 bytes>. The simulated watch answers the size
+command (28) with ab 05 28 01 <crc> and acknowledges chunks with
+ab 06 29 <count (2 bytes)> <crc>, count being the number of chunks
+received without gap, also sent at once when a retransmitted chunk
+fills a gap. If chunks are missing, the acknowledgement goes on
+with the highest chunk received and up to 6 missing chunk indexes:
+ab <length> 29 <count> <highest> <missing> ... <crc>. The check command
+(2a) is answered with ab 08 2a <CRC-32 of the face (4 bytes)> <crc>.
+"""
+import json
+import zlib
+import traceback
+from queue import Queue
+from threading import Thread, Lock
+from hashlib import md5
+from random import Random, randbytes
+from struct import pack
+from time import perf_counter, sleep
+
+from auth import ota_auth
+from crc8dallas import calc
+from frames import FrameDecoder, build_frame, FLAG_COMMAND
+from transport import CentralTransport
+
+# OTA opcodes
+OPCODE_GET_MD5 = 0xd4
+OPCODE_GET_FILE_INFO_OFFSET = 0xe1
+OPCODE_INQUIRE_CAN_UPDATE = 0xe2
+OPCODE_ENTER_UPDATE_MODE = 0xe3
+OPCODE_EXIT_UPDATE_MODE = 0xe4
+OPCODE_SEND_FIRMWARE_BLOCK = 0xe5
+OPCODE_GET_REFRESH_STATUS = 0xe6
+OPCODE_REBOOT = 0xe7
+
+# Lefun commands
+LF_CMD_UPLOAD_SIZE = 0x28
+LF_CMD_UPLOAD_CHUNK = 0x29
+LF_CMD_UPLOAD_CHECK = 0x2a
+
+# Missing chunks listed in a chunk acknowledgement, at most
+LF_MAX_NACKS = 6
+
+def lefun_frame(command: int, data: bytes) -> bytes:
+    """Build a Lefun frame
+    """
+    frame = bytes([0xab, len(data) + 4, command]) + data
+    return frame + bytes([calc(frame)])
+
+class SimulatedCharacteristic:
+    """Characteristic of a simulated peripheral
+    """
+
+    def __init__(self, periph, service, uuid):
+        self.service = service
+        self.uuid = uuid
+        self.callback = None
+        self.__periph = periph
+
+    @property
+    def value(self):
+        return None
+
+    @value.setter
+    def value(self, data: bytes):
+        self.write(data)
+
+    def write(self, data: bytes, without_response: bool = False):
+        self.__periph.on_link_write(self, bytes(data), without_response)
+
+    def subscribe(self, callback=None, **kwargs):
+        self.callback = callback
+
+class SimulatedPeripheral:
+    """Simulated JieLi watch
+
+    `firmware` is the image the bootloader expects: it requests it block
+    by block (`block_size` bytes) once update mode is entered, and
+    reports success if the received data matches.
+    """
+
+    def __init__(self, latency: float = 0.0, mtu: int = 23, loss: float = 0.0,
+                 firmware: bytes = None, block_size: int = 512, header_size: int = 32,
+                 ack_interval: int = 16, seed: int = None, discovery_time: float = 0.0,
+                 version: str = "1.0"):
+        self.__latency = latency
+        self.mtu = mtu
+        self.loss = loss
+        self.dropped = 0
+        self.__random = Random(seed)
+        self.__lock = Lock()
+        self.__send = SimulatedCharacteristic(self, "AE00", "AE01")
+        self.__recv = SimulatedCharacteristic(self, "AE00", "AE02")
+        self.__lf_send = SimulatedCharacteristic(self, "18D0", "2D01")
+        self.__lf_recv = SimulatedCharacteristic(self, "18D0", "2D00")
+        self.version = version
+        self.discovery_time = discovery_time
+        self.discovered = False
+        self.connected = False
+        self.__connection = 0
+        self.__disconnect_cb = None
+        self.__challenge = None
+        # Firmware blocks are sent back in a single frame
+        self.__decoder = FrameDecoder(max_length=max(1024, block_size + 16))
+        self.__queue = Queue()
+        Thread(target=self.__deliver, daemon=True).start()
+
+        # Bootloader
+        self.firmware = firmware or b""
+        self.block_size = block_size
+        self.header_size = header_size
+        self.received = bytearray(len(self.firmware))
+        self.updated = False
+        self.rebooted = False
+        self.__sequence = 0
+        self.__block = None
+
+        # Lefun upload
+        self.ack_interval = ack_interval
+        self.face = bytearray()
+        self.chunks = None
+        self.contiguous = 0
+        self.highest = -1
+        self.__unacked = 0
+
+    def __deliver(self):
+        while True:
+            due, connection, characteristic, data = self.__queue.get()
+            delay = due - perf_counter()
+            if delay > 0:
+                sleep(delay)
+            if characteristic is None:
+                # Link loss
+                if self.__disconnect_cb is not None:
+                    self.__disconnect_cb()
+                continue
+            if connection != self.__connection:
+                # Sent on a previous connection
+                continue
+            if characteristic.callback is not None:
+                # Errors in the central callback must not stop the link
+                try:
+                    characteristic.callback(characteristic, data, False)
+                except Exception:
+                    traceback.print_exc()
+
+    def notify(self, data: bytes, characteristic=None):
+        """Send a notification to the central
+        """
+        characteristic = characteristic or self.__recv
+        self.__queue.put((perf_counter() + self.__latency, self.__connection, characteristic, data))
+
+    def characteristics(self):
+        return [self.__send, self.__recv, self.__lf_send, self.__lf_recv]
+
+    def on_connect(self, profile: str = None):
+        """New connection, using `profile` (from export_json()) if given
+        """
+        self.discovered = profile is not None and json.loads(profile)["version"] == self.version
+        with self.__lock:
+            self.__connection += 1
+            self.connected = True
+            self.__decoder.reset()
+
+    def set_disconnect_cb(self, callback):
+        self.__disconnect_cb = callback
+
+    def disconnect(self):
+        """Disconnection initiated by the central
+        """
+        with self.__lock:
+            self.__connection += 1
+            self.connected = False
+
+    def drop_link(self):
+        """Simulate a link loss, the central is notified after `latency`
+        """
+        self.disconnect()
+        self.__queue.put((perf_counter() + self.__latency, self.__connection, None, None))
+
+    def discover(self):
+        sleep(self.discovery_time)
+        self.discovered = True
+
+    def exchange_mtu(self, mtu: int) -> int:
+        """MTU exchange, returns the MTU used on the link
+        """
+        return min(mtu, self.mtu)
+
+    def export_json(self) -> str:
+        return json.dumps({
+            "version": self.version,
+            "characteristics": [[c.service, c.uuid] for c in self.characteristics()]
+        })
+
+    def get_characteristic(self, service, charac):
+        if not self.discovered:
+            return None
+        for characteristic in self.characteristics():
+            if (str(service).upper() == characteristic.service
+                    and str(charac).upper() == characteristic.uuid):
+                return characteristic
+        return None
+
+    def on_link_write(self, characteristic, data: bytes, without_response: bool):
+        """Write from the central, through the simulated link
+        """
+        if len(data) > self.mtu - 3:
+            raise ValueError(f"write of {len(data)} bytes exceeds MTU {self.mtu}")
+        with self.__lock:
+            if not self.connected:
+                raise ConnectionError("link lost")
+            if (without_response and characteristic is self.__lf_send and self.loss > 0
+                    and self.__random.random() < self.loss):
+                self.dropped += 1
+                return
+            self.on_write(characteristic, data)
+
+    def on_write(self, characteristic, data: bytes):
+        if characteristic is self.__lf_send:
+            self.on_lefun(data)
+        elif characteristic is self.__send:
+            if data[:3] == b"\xfe\xdc\xba" or self.__decoder.buffered > 0:
+                for frame in self.__decoder.feed(data):
+                    self.on_frame(frame)
+            else:
+                self.on_auth(data)
+
+    def on_auth(self, data: bytes):
+        if data[0] == 0x00:
+            # Phone challenge
+            self.notify(bytes([0x01]) + ota_auth(data[1:17]))
+        elif data[0] == 0x02:
+            # Auth result from phone, send our own challenge
+            self.__challenge = randbytes(16)
+            self.notify(bytes([0x00]) + self.__challenge)
+        elif data[0] == 0x01:
+            # Phone response to our challenge
+            passed = data[1:17] == ota_auth(self.__challenge)
+            self.notify(bytes([0x02]) + (b"pass" if passed else b"fail"))
+
+    def respond(self, frame, data: bytes = b"", status: int = 0):
+        """Answer a command from the central
+        """
+        self.notify(build_frame(0x00, frame.opcode, bytes([status, frame.sequence]) + data))
+
+    def request_block(self, offset: int, length: int):
+        """Ask the central for a firmware block (0/0 ends the transfer)
+        """
+        self.__block = (offset, length)
+        self.notify(build_frame(0xc0, OPCODE_SEND_FIRMWARE_BLOCK,
+                                bytes([self.__sequence]) + pack(">IH", offset, length)))
+        self.__sequence = (self.__sequence + 1) & 0xff
+
+    def next_block(self):
+        offset = 0 if self.__block is None else self.__block[0] + self.__block[1]
+        length = min(self.block_size, len(self.firmware) - offset)
+        if length > 0:
+            self.request_block(offset, length)
+        else:
+            self.request_block(0, 0)
+            self.__block = None
+
+    def on_frame(self, frame):
+        if frame.flag & FLAG_COMMAND:
+            if frame.opcode == OPCODE_GET_MD5:
+                self.respond(frame, md5(self.firmware).hexdigest().encode())
+            elif frame.opcode == OPCODE_GET_FILE_INFO_OFFSET:
+                self.respond(frame, pack(">IH", 0, self.header_size))
+            elif frame.opcode == OPCODE_INQUIRE_CAN_UPDATE:
+                header = frame.payload[1:]
+                self.respond(frame, bytes([0 if header == self.firmware[:self.header_size] else 1]))
+            elif frame.opcode == OPCODE_ENTER_UPDATE_MODE:
+                self.respond(frame, bytes([0]))
+                if self.__block is not None:
+                    # Resume an interrupted transfer
+                    self.request_block(*self.__block)
+                else:
+                    self.next_block()
+            elif frame.opcode == OPCODE_GET_REFRESH_STATUS:
+                self.updated = self.received == self.firmware
+                self.respond(frame, bytes([0 if self.updated else 1]))
+            elif frame.opcode == OPCODE_REBOOT:
+                self.rebooted = True
+                self.respond(frame)
+            else:
+                self.respond(frame)
+        elif frame.opcode == OPCODE_SEND_FIRMWARE_BLOCK and self.__block is not None:
+            # Block sent by the central: status, sequence number, data
+            offset, length = self.__block
+            data = frame.payload[2:]
+            if len(data) == length:
+                self.received[offset:offset + length] = data
+                self.next_block()
+            else:
+                # Ask again
+                self.request_block(offset, length)
+
+    def on_lefun(self, data: bytes):
+        if len(data) == 20 and data[:2] == bytes([0xab, LF_CMD_UPLOAD_CHUNK]):
+            if self.chunks is None:
+                return
+            index = (data[2] << 8) | data[3]
+            if index < len(self.chunks):
+                self.face[16*index:16*(index + 1)] = data[4:20]
+                self.chunks[index] = 1
+                # Retransmitted chunks filling a gap are acknowledged at once
+                refill = index < self.highest
+                self.highest = max(self.highest, index)
+                while self.contiguous < len(self.chunks) and self.chunks[self.contiguous]:
+                    self.contiguous += 1
+                self.__unacked += 1
+                if self.ack_interval and (self.__unacked >= self.ack_interval
+                                          or index == len(self.chunks) - 1 or refill):
+                    self.ack_chunks()
+        elif len(data) == 6 and data[0] == 0xab and data[2] == LF_CMD_UPLOAD_SIZE:
+            if calc(data[:5]) != data[5]:
+                return
+            count = (data[3] << 8) | data[4]
+            self.face = bytearray(16 * count)
+            self.chunks = bytearray(count)
+            self.contiguous = 0
+            self.highest = -1
+            self.__unacked = 0
+            self.notify(lefun_frame(LF_CMD_UPLOAD_SIZE, bytes([0x01])), self.__lf_recv)
+        elif len(data) == 4 and data[0] == 0xab and data[2] == LF_CMD_UPLOAD_CHECK:
+            if calc(data[:3]) != data[3]:
+                return
+            self.notify(lefun_frame(LF_CMD_UPLOAD_CHECK, pack(">I", zlib.crc32(self.face))),
+                        self.__lf_recv)
+
+    def ack_chunks(self):
+        """Notify the number of chunks received without gap, then the
+        highest chunk received and the first missing ones if any
+        """
+        self.__unacked = 0
+        data = pack(">H", self.contiguous)
+        if self.highest > self.contiguous:
+            missing = [index for index in range(self.contiguous, self.highest)
+                       if not self.chunks[index]][:LF_MAX_NACKS]
+            data += pack(f">{len(missing) + 1}H", self.highest, *missing)
+        self.notify(lefun_frame(LF_CMD_UPLOAD_CHUNK, data), self.__lf_recv)
+
+    @property
+    def upload_complete(self) -> bool:
+        return self.chunks is not None and self.contiguous == len(self.chunks)
+
+class SimulatedCentral:
+    """Central connecting to simulated peripherals
+
+    Extra keyword arguments are passed to every SimulatedPeripheral.
+    """
+
+    def __init__(self, latency: float = 0.0, **kwargs):
+        self.__latency = latency
+        self.__kwargs = kwargs
+        self.peripherals = {}
+
+    def connect(self, bdaddr, profile: str = None):
+        """Connect to `bdaddr`, the same peripheral is returned on
+        reconnection
+        """
+        periph = self.peripherals.get(bdaddr)
+        if periph is None:
+            periph = SimulatedPeripheral(self.__latency, **self.__kwargs)
+            self.peripherals[bdaddr] = periph
+        periph.on_connect(profile)
+        return periph
+
+class SimulatedTransport(CentralTransport):
+    """Transport to simulated watches
+
+    Several transports may share the same `central`, otherwise one is
+    created with `latency` and the extra keyword arguments.
+    """
+
+    def __init__(self, central: SimulatedCentral = None, latency: float = 0.0, **kwargs):
+        super().__init__(central or SimulatedCentral(latency, **kwargs))
+        self.__profile = None
+
+    def connect(self, bdaddr: str):
+        self.peripheral = self.central.connect(bdaddr, self.__profile)
+        self.watch_link()
+
+    def export_profile(self) -> str:
+        return self.peripheral.export_json()
+
+    def load_profile(self, profile: str) -> bool:
+        self.__profile = profile
+        return True
@@ -0,0 +1,180 @@
+"""BLE transports
+
+OtaDevice does not talk to a BLE stack directly but through a transport,
+providing connect, discover, write, write without response and subscribe
+on characteristics designated by their service and characteristic UUIDs
+(e.g. "AE00", "AE01").
+
+CentralTransport drives any object exposing the WHAD central API
+(connect() returning a peripheral with discover() and
+get_characteristic()). WhadTransport creates a WHAD central on a local
+interface, whad is only imported when such a transport is created.
+simulator.SimulatedTransport runs against simulated watches, without any
+radio.
+
+The GATT profile discovered by WHAD and simulated transports can be
+exported, and loaded on later connections to skip discovery (see
+gatt_cache.py).
+
+The ATT MTU is only negotiated with peripherals providing exchange_mtu()
+(simulated ones): WhadTransport does not negotiate it, clients then
+assume the MTU they are configured with.
+"""
+
+class Transport:
+    """BLE link to a single peripheral
+    """
+
+    disconnect_callback = None
+
+    def set_disconnect_callback(self, callback):
+        """Call `callback` (without arguments) whenever the link is lost,
+        not when closed by disconnect()
+        """
+        self.disconnect_callback = callback
+
+    def connect(self, bdaddr: str):
+        """Connect to peripheral `bdaddr`, raises an exception on failure
+        """
+        raise NotImplementedError
+
+    def disconnect(self):
+        """Close the connection
+        """
+
+    def discover(self):
+        """Discover services and characteristics
+        """
+        raise NotImplementedError
+
+    def export_profile(self) -> str:
+        """Returns the discovered GATT profile, None if not supported
+        """
+        return None
+
+    def load_profile(self, profile: str) -> bool:
+        """Use `profile` (from export_profile()) on the next connections
+        instead of discovering (None to stop). Returns False if not
+        supported.
+        """
+        return False
+
+    def exchange_mtu(self, mtu: int) -> int:
+        """Request an ATT MTU of `mtu` on the connection, returns the MTU
+        negotiated with the peripheral, None if not supported
+        """
+        return None
+
+    def characteristic(self, service: str, uuid: str):
+        """Returns a handle on a characteristic, used by the methods below
+        """
+        raise NotImplementedError
+
+    def write(self, characteristic, data: bytes):
+        """Write a value, waiting for the peripheral to acknowledge it
+        """
+        raise NotImplementedError
+
+    def write_without_response(self, characteristic, data: bytes):
+        """Write a value, without acknowledgement. `data` may be any
+        bytes-like object, reused by the caller once this returns.
+        """
+        raise NotImplementedError
+
+    def subscribe(self, characteristic, callback):
+        """Call `callback` with (characteristic, value, indication) for
+        every notification sent by the peripheral
+        """
+        raise NotImplementedError
+
+class CentralTransport(Transport):
+    """Transport over a WHAD-like central
+    """
+
+    def __init__(self, central):
+        self.central = central
+        self.peripheral = None
+
+    def uuid(self, value: str):
+        """Convert a UUID string to the central representation
+        """
+        return value
+
+    def connect(self, bdaddr: str):
+        self.peripheral = self.central.connect(bdaddr)
+        self.watch_link()
+
+    def watch_link(self):
+        """Get notified when the connected peripheral goes away
+        """
+        if hasattr(self.peripheral, "set_disconnect_cb"):
+            self.peripheral.set_disconnect_cb(self.on_link_lost)
+
+    def on_link_lost(self, *args):
+        if self.peripheral is not None and self.disconnect_callback is not None:
+            self.disconnect_callback()
+
+    def disconnect(self):
+        # Clear the peripheral first, this is not a link loss
+        peripheral, self.peripheral = self.peripheral, None
+        if peripheral is not None and hasattr(peripheral, "disconnect"):
+            peripheral.disconnect()
+
+    def discover(self):
+        self.peripheral.discover()
+
+    def exchange_mtu(self, mtu: int) -> int:
+        if hasattr(self.peripheral, "exchange_mtu"):
+            return self.peripheral.exchange_mtu(mtu)
+        return None
+
+    def characteristic(self, service: str, uuid: str):
+        characteristic = self.peripheral.get_characteristic(self.uuid(service), self.uuid(uuid))
+        if characteristic is None:
+            raise LookupError(f"characteristic {service}/{uuid} not found")
+        return characteristic
+
+    def write(self, characteristic, data: bytes):
+        characteristic.value = data
+
+    def write_without_response(self, characteristic, data: bytes):
+        characteristic.write(data, without_response=True)
+
+    def subscribe(self, characteristic, callback):
+        characteristic.subscribe(callback=callback)
+
+class WhadTransport(CentralTransport):
+    """Transport over a WHAD central on a local interface (e.g. "hci0")
+    """
+
+    def __init__(self, interface: str = "hci0"):
+        from whad.device import WhadDevice
+        from whad.ble import Central
+        from whad.ble.profile.attribute import UUID
+
+        self.__central = Central
+        self.__uuid = UUID
+        self.__profile = None
+        self.interface = WhadDevice.create(interface)
+        super().__init__(Central(self.interface))
+
+    def uuid(self, value: str):
+        return self.__uuid(value)
+
+    def connect(self, bdaddr: str):
+        if self.__profile is not None:
+            # Central populating the peripheral profile from JSON
+            self.central = self.__central(self.interface, from_json=self.__profile)
+        super().connect(bdaddr)
+
+    def write_without_response(self, characteristic, data: bytes):
+        super().write_without_response(characteristic, bytes(data))
+
+    def export_profile(self) -> str:
+        return self.peripheral.export_json()
+
+    def load_profile(self, profile: str) -> bool:
+        if profile is None and self.__profile is not None:
+            self.central = self.__central(self.interface)
+        self.__profile = profile
+        return True
@@ -1,28 +1,43 @@
 """JeiLi OTA authentication algorithm
 """
 
-from h import H
+from h import H, H_fast
 
 K = bytes.fromhex("06775f87918dd423005df1d8cf0c142b")
+BDADDR = bytes.fromhex("112233332211")
 
-def ota_auth(challenge: bytes) -> bytes:
+def ota_auth(challenge: bytes, trace: bool = False) -> bytes:
     """Compute the expected response for the given challenge, based
     on JeiLi's authentication algorithm.
 
     :param challenge: Challenge
     :type challenge: bytes
+    :param trace: Use the reference H() implementation, which logs its
+                  intermediate values (see constants.enable_debug_logging)
+    :type trace: bool
     :return: Computed response
     :rtype: bytes
     """
-    bdaddr = bytes.fromhex("112233332211")
-    _,_,_,_,response = H(bytearray(K), bytearray(challenge), bytearray(bdaddr), 6)
+    if trace:
+        _,_,_,_,response = H(bytearray(K), bytearray(challenge), bytearray(BDADDR), 6)
+        return response
+
+    response = H_fast(K, challenge, BDADDR, 6)
 
     # Return the computed challenge response
     return response
 
 if __name__ == "__main__":
-    response = jl_ota_auth(bytes.fromhex("08e1d0bc75aa4ac8343ca6b142105062"))
+    import sys
+    from constants import enable_debug_logging
+
+    trace = "-v" in sys.argv[1:]
+    if trace:
+        enable_debug_logging()
+
+    response = ota_auth(bytes.fromhex("08e1d0bc75aa4ac8343ca6b142105062"), trace)
     print(f"Response: {response.hex()}")
     expected = bytes.fromhex("5101b7d2e2b497a23e9232f5aa615962")
     print(f"Expected: {expected.hex()}")
+    assert response == expected
 
@@ -0,0 +1,93 @@
+"""Watch face upload benchmark
+
+Uploads a random watch face to simulated watches (see simulator.py) and
+reports the end-to-end upload throughput (until the watch acknowledged
+the last chunk), the chunks lost on the link and retransmitted, and
+whether the watch received the face intact (and, with -v, whether the
+client verified its checksum). Several watches can be driven at once,
+each from its own thread. With -a 0, the watches never acknowledge
+chunks, as older ones do: chunks are then paced every -i ms.
+
+Usage: python3 bench_upload.py [-s size] [-l latency_ms] [-m mtu] [-p loss] [-d devices]
+                              [-w window] [-c cache_dir] [-a ack_interval] [-i interval_ms] [-v]
+"""
+import os
+import argparse
+import importlib
+import tempfile
+from contextlib import redirect_stdout
+from random import randbytes
+from threading import Thread
+from time import perf_counter
+
+from simulator import SimulatedCentral, SimulatedTransport
+from frame_cache import FrameCache
+
+# upload-face.py is not a valid module name
+OtaDevice = importlib.import_module("upload-face").OtaDevice
+
+def upload(central, bdaddr: str, path: str, window: int, frame_cache, verify: bool,
+           interval: float, results: dict):
+    dev = OtaDevice(bdaddr, transport=SimulatedTransport(central), window=window,
+                    frame_cache=frame_cache, verify=verify, unacked_interval=interval)
+    dev.connect()
+    dev.authenticate()
+    assert dev.wait_for_auth()
+    start = perf_counter()
+    dev.upload(path)
+    completed = dev.wait_for_upload()
+    results[bdaddr] = (perf_counter() - start, completed, dev.retransmitted, dev.verified)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure watch face upload throughput")
+    parser.add_argument("-s", "--size", type=int, default=64*1024, help="face size (bytes)")
+    parser.add_argument("-l", "--latency", type=float, default=10.0, help="link latency (ms)")
+    parser.add_argument("-m", "--mtu", type=int, default=23, help="ATT MTU")
+    parser.add_argument("-p", "--loss", type=float, default=0.0, help="write loss probability")
+    parser.add_argument("-d", "--devices", type=int, default=1, help="watches uploaded at once")
+    parser.add_argument("-w", "--window", type=int, default=64, help="initial upload window (chunks)")
+    parser.add_argument("-c", "--cache", help="upload frame cache directory")
+    parser.add_argument("-a", "--ack-interval", type=int, default=16,
+                        help="chunks acknowledged at once by the watches (0: never)")
+    parser.add_argument("-i", "--interval", type=float, default=1.0,
+                        help="chunk interval for watches that do not acknowledge chunks (ms)")
+    parser.add_argument("-v", "--verify", action="store_true", help="verify face checksums")
+    args = parser.parse_args()
+
+    face = randbytes(args.size)
+    with tempfile.NamedTemporaryFile(suffix=".bin", delete=False) as tmp:
+        tmp.write(face)
+    try:
+        central = SimulatedCentral(args.latency / 1e3, mtu=args.mtu, loss=args.loss,
+                                   ack_interval=args.ack_interval)
+        bdaddrs = [f"00:00:00:00:00:{i:02x}" for i in range(args.devices)]
+        results = {}
+        frame_cache = FrameCache(args.cache) if args.cache else None
+        # The client logs every chunk, keep that out of the measurements
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            start = perf_counter()
+            threads = [Thread(target=upload, args=(central, bdaddr, tmp.name, args.window,
+                                                         frame_cache, args.verify,
+                                                         args.interval / 1e3, results))
+                       for bdaddr in bdaddrs]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            total = perf_counter() - start
+    finally:
+        os.unlink(tmp.name)
+
+    padded = face + bytes(-len(face) % 16)
+    for bdaddr in bdaddrs:
+        elapsed, completed, retransmitted, verified = results[bdaddr]
+        periph = central.peripherals[bdaddr]
+        intact = bytes(periph.face) == padded
+        check = {True: "verified", False: "checksum mismatch", None: "not verified"}[verified]
+        print(f"{bdaddr}: {args.size/elapsed/1024:.1f} kB/s, {periph.dropped} chunks lost, "
+              f"{retransmitted} retransmitted, "
+              f"{'intact' if intact else 'CORRUPTED'}, "
+              f"{check}"
+              f"{'' if completed else ' (timed out)'}")
+    print(f"Aggregate: {args.size*args.devices/total/1024:.1f} kB/s "
+          f"({args.devices} watches, {args.latency:.1f} ms latency, MTU {args.mtu}, loss {args.loss})")
@@ -14,6 +14,33 @@ if sys.version_info[0] == 3:
     import codecs
 
 def calc(msg: bytes):
+    """CRC-8/Maxim of `msg` (bytes, bytearray or memoryview)"""
+    return update(0, msg)
+
+def update(crc: int, data) -> int:
+    """Returns `crc` updated with `data` (bytes, bytearray or memoryview)"""
+    table = CRC8_TABLE
+    for b in data:
+        crc = table[crc ^ b]
+    return crc
+
+def calc_many(buffer, size: int) -> bytes:
+    """CRC-8 of each `size`-byte frame of `buffer` (whose length must be a
+    multiple of `size`), one byte per frame.
+
+    Frames are processed column by column: one translate() over all frames
+    per byte position, instead of one table lookup per byte."""
+    buffer = bytes(buffer)
+    assert len(buffer) % size == 0
+    count = len(buffer) // size
+    crcs = 0
+    for i in range(size):
+        column = int.from_bytes(buffer[i::size], "big")
+        crcs = int.from_bytes((crcs ^ column).to_bytes(count, "big").translate(CRC8_TABLE), "big")
+    return crcs.to_bytes(count, "big")
+
+def calc_bitwise(msg: bytes):
+    """Reference implementation, 8 shift/xor per byte"""
     check = 0
     for i in msg:
         check = AddToCRC(i, check)
@@ -30,21 +57,35 @@ def AddToCRC(b, crc):
             crc ^= 0x8C # this means crc ^= 140
     return crc
 
+# CRC of every byte value, the CRC is reflected so that processing byte b
+# with register crc is the same as processing b ^ crc from 0
+CRC8_TABLE = bytes(AddToCRC(i, 0) for i in range(256))
+
+def check_table(rounds: int = 1000):
+    """Compare the table-driven CRC with the bitwise one on random data"""
+    from random import randbytes, randrange
+    for _ in range(rounds):
+        msg = randbytes(randrange(64))
+        if calc(msg) != calc_bitwise(msg) or calc(memoryview(msg)) != calc_bitwise(msg):
+            return False
+    frames = randbytes(20 * 100)
+    return calc_many(frames, 20) == bytes(calc_bitwise(frames[20*i:20*(i+1)]) for i in range(100))
+
 def check(incoming):
-    """Returns True if CRC Outcome Is 0xx or 0x0"""
-    result = calc(incoming)
-    if result == "0x0" or result == "0x00":
-        return True
-    else:
-        return False
+    """Returns True if the CRC of the message with its CRC appended is 0"""
+    return calc(incoming) == 0
 
 def append(incoming):
     """Returns the Incoming message after appending it's CRC CheckSum"""
-    result = calc(incoming).split('x')[1].zfill(2)
-    return incoming + result
+    return bytes(incoming) + bytes([calc(incoming)])
 
 if __name__ == '__main__':
 
+    if len(sys.argv) > 1 and sys.argv[1] == "-t":
+        assert check_table()
+        print("CRC table: OK")
+        sys.exit(0)
+
     if not sys.stdin.isatty():
         # there's something in stdin
         msg = sys.stdin.read().strip()
@@ -58,7 +99,8 @@ if __name__ == '__main__':
         sys.exit(1)
 
     try:
-        sys.stdout.write(calc(msg))
+        # Message given in hex
+        sys.stdout.write("{0:02x}\n".format(calc(bytes.fromhex(msg))))
         sys.exit(0)
     except Exception as err:
         print("An Error Occured: {0}".format(err))
@@ -0,0 +1,66 @@
+"""Watch face upload frame cache
+
+Upload frames (ab 29 <index (2 bytes)> <16 bytes of face>) only depend on
+the face content. They are encoded once per face into a single file of
+contiguous 20-byte frames, named after the SHA-256 of the face, so that
+later uploads of the same face map that file and send its frames as is:
+no padding, chunking or framing.
+
+Usage: python3 frame_cache.py <face file> [<face file> ...]
+"""
+import os
+import sys
+import hashlib
+import tempfile
+
+DEFAULT_DIR = os.path.join(os.path.expanduser("~"), ".cache", "jieli-ota", "frames")
+
+FRAME_SIZE = 20
+CHUNK_SIZE = 16
+
+def encode_frames(face) -> bytearray:
+    """Encode the upload frames of `face` (bytes-like), the last chunk is
+    zero-padded
+    """
+    face = memoryview(face)
+    count = (len(face) + CHUNK_SIZE - 1) // CHUNK_SIZE
+    frames = bytearray(FRAME_SIZE * count)
+    for index in range(count):
+        offset = FRAME_SIZE * index
+        chunk = face[CHUNK_SIZE*index:CHUNK_SIZE*(index + 1)]
+        frames[offset:offset + 4] = bytes([0xab, 0x29, (index>>8)&0xff, index&0xff])
+        frames[offset + 4:offset + 4 + len(chunk)] = chunk
+    return frames
+
+class FrameCache:
+
+    def __init__(self, directory: str = DEFAULT_DIR):
+        """Initialize cache stored in `directory`
+        """
+        self.directory = directory
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.directory, f"{digest}.frames")
+
+    def frames(self, face_path: str) -> str:
+        """Returns the path of the frame file of face `face_path`, encoded
+        and stored first if not cached yet
+        """
+        with open(face_path, "rb") as face:
+            content = face.read()
+        path = self.path(hashlib.sha256(content).hexdigest())
+        if not os.path.exists(path):
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as frames:
+                frames.write(encode_frames(content))
+            os.replace(tmp, path)
+        return path
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        cache = FrameCache()
+        for face_path in sys.argv[1:]:
+            print(f"{face_path}: {cache.frames(face_path)}")
+    else:
+        print("Usage: python3 frame_cache.py <face file> [<face file> ...]")
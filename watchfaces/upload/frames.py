@@ -0,0 +1,172 @@
+"""JieLi OTA frames
+
+fe dc ba <flag> <opcode> <length (2 bytes, big endian)> <payload> ef
+
+For a command (flag bit 7 set) the payload starts with its sequence
+number, a response payload starts with a status byte followed by the
+sequence number of the command it answers.
+
+Running this module checks the decoder against random frames.
+"""
+from collections import namedtuple
+from struct import pack
+
+MAGIC = b"\xfe\xdc\xba"
+TRAILER = 0xef
+HEADER_LEN = 7
+
+FLAG_COMMAND = 0x80
+
+Frame = namedtuple("Frame", ["flag", "opcode", "sequence", "payload"])
+
+def build_frame(flag: int, opcode: int, payload: bytes) -> bytes:
+    """Build a frame around `payload`
+    """
+    return MAGIC + pack(">BBH", flag, opcode, len(payload)) + bytes(payload) + bytes([TRAILER])
+
+def frame_sequence(flag: int, payload: bytes) -> int:
+    """Sequence number carried by a frame payload, or None
+    """
+    index = 0 if flag & FLAG_COMMAND else 1
+    return payload[index] if len(payload) > index else None
+
+class FrameDecoder:
+    """Incremental frame decoder
+
+    Notification fragments are copied into a preallocated ring buffer
+    (grown only when a frame does not fit), and complete frames are
+    extracted from it. Bytes that cannot start a valid frame are dropped
+    until the next magic.
+    """
+
+    def __init__(self, capacity: int = 4096, max_length: int = 1024):
+        """Initialize decoder, `capacity` is rounded up to a power of two.
+        A magic followed by a length above `max_length` is not taken as
+        the start of a frame.
+        """
+        size = 1
+        while size < capacity:
+            size <<= 1
+        self.__buffer = bytearray(size)
+        self.__mask = size - 1
+        self.__head = 0
+        self.__count = 0
+        self.max_length = max_length
+        self.dropped = 0
+
+    @property
+    def buffered(self) -> int:
+        """Number of bytes waiting for the rest of their frame
+        """
+        return self.__count
+
+    def reset(self):
+        """Discard buffered data
+        """
+        self.__head = 0
+        self.__count = 0
+
+    def __grow(self, needed: int):
+        size = len(self.__buffer)
+        while size < needed:
+            size <<= 1
+        buffer = bytearray(size)
+        buffer[:self.__count] = self.__read(0, self.__count)
+        self.__buffer = buffer
+        self.__mask = size - 1
+        self.__head = 0
+
+    def __write(self, data):
+        size = len(self.__buffer)
+        if self.__count + len(data) > size:
+            self.__grow(self.__count + len(data))
+            size = len(self.__buffer)
+        start = (self.__head + self.__count) & self.__mask
+        first = min(len(data), size - start)
+        self.__buffer[start:start + first] = data[:first]
+        self.__buffer[:len(data) - first] = data[first:]
+        self.__count += len(data)
+
+    def __read(self, offset: int, length: int) -> bytes:
+        start = (self.__head + offset) & self.__mask
+        end = start + length
+        if end <= len(self.__buffer):
+            return bytes(self.__buffer[start:end])
+        return bytes(self.__buffer[start:]) + bytes(self.__buffer[:end & self.__mask])
+
+    def __byte(self, offset: int) -> int:
+        return self.__buffer[(self.__head + offset) & self.__mask]
+
+    def __skip(self, length: int):
+        self.__head = (self.__head + length) & self.__mask
+        self.__count -= length
+
+    def __sync(self) -> bool:
+        """Drop bytes until the buffer starts with the magic (or a prefix
+        of it), returns True if a full magic is available
+        """
+        while self.__count > 0:
+            matched = 0
+            while matched < min(len(MAGIC), self.__count) and self.__byte(matched) == MAGIC[matched]:
+                matched += 1
+            if matched == len(MAGIC):
+                return True
+            if matched == self.__count:
+                # Partial magic, wait for more data
+                return False
+            self.__skip(1)
+            self.dropped += 1
+        return False
+
+    def feed(self, data) -> list:
+        """Add a fragment, returns the list of frames it completed
+        """
+        frames = []
+        self.__write(memoryview(data))
+        while self.__sync() and self.__count >= HEADER_LEN:
+            length = (self.__byte(5) << 8) | self.__byte(6)
+            total = HEADER_LEN + length + 1
+            if length <= self.max_length and self.__count < total:
+                break
+            if length > self.max_length or self.__byte(total - 1) != TRAILER:
+                # Not a frame after all, resync after this magic
+                self.__skip(1)
+                self.dropped += 1
+                continue
+            flag, opcode = self.__byte(3), self.__byte(4)
+            payload = self.__read(HEADER_LEN, length)
+            self.__skip(total)
+            frames.append(Frame(flag, opcode, frame_sequence(flag, payload), payload))
+        return frames
+
+def check_decoder(rounds: int = 2000) -> bool:
+    """Feed `rounds` random frames, mixed with garbage and split at random,
+    to a decoder and compare the frames it returns"""
+    from random import randbytes, randrange
+    stream = bytearray()
+    expected = []
+    for _ in range(rounds):
+        if randrange(4) == 0:
+            # Garbage that cannot start a magic
+            stream += bytes(b for b in randbytes(randrange(1, 8)) if b != MAGIC[0])
+        flag = randrange(256)
+        opcode = randrange(256)
+        payload = randbytes(randrange(300))
+        stream += build_frame(flag, opcode, payload)
+        expected.append(Frame(flag, opcode, frame_sequence(flag, payload), payload))
+
+    # A stray magic with a huge length must not hide the frames after it
+    stream[:0] = MAGIC + bytes([0, 0, 0xff, 0xff])
+
+    decoder = FrameDecoder(64, max_length=300)
+    decoded = []
+    offset = 0
+    while offset < len(stream):
+        size = randrange(1, 64)
+        decoded += decoder.feed(stream[offset:offset + size])
+        offset += size
+    return decoded == expected and decoder.buffered == 0
+
+if __name__ == "__main__":
+    assert check_decoder(), "decoded frames do not match"
+    print("Frame decoder: OK")
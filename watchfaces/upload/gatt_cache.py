@@ -0,0 +1,61 @@
+"""GATT profile cache
+
+Keeps the GATT profile discovered on each watch (as exported by its
+transport) in a JSON file, keyed by BD address and firmware version, so
+that reconnections can skip service discovery. An entry recorded for
+another firmware version is considered stale and ignored.
+"""
+import os
+import json
+from threading import Lock
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "jieli-ota", "gatt.json")
+
+class GattCache:
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        """Initialize cache stored in `path`
+        """
+        self.path = path
+        self.__lock = Lock()
+        self.__entries = None
+
+    def __load(self) -> dict:
+        if self.__entries is None:
+            try:
+                with open(self.path, "r") as cache:
+                    self.__entries = json.load(cache)
+            except (OSError, ValueError):
+                self.__entries = {}
+        return self.__entries
+
+    def __save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as cache:
+            json.dump(self.__entries, cache)
+        os.replace(tmp, self.path)
+
+    def get(self, bdaddr: str, version: str = None) -> str:
+        """Returns the profile cached for `bdaddr`, None if missing or
+        recorded for another firmware `version` (any version if None)
+        """
+        with self.__lock:
+            entry = self.__load().get(bdaddr.lower())
+        if entry is None or (version is not None and entry["version"] != version):
+            return None
+        return entry["profile"]
+
+    def put(self, bdaddr: str, profile: str, version: str = None):
+        """Record the profile discovered on `bdaddr`
+        """
+        with self.__lock:
+            self.__load()[bdaddr.lower()] = {"version": version, "profile": profile}
+            self.__save()
+
+    def invalidate(self, bdaddr: str):
+        """Forget the profile of `bdaddr` (e.g. after a firmware update)
+        """
+        with self.__lock:
+            if self.__load().pop(bdaddr.lower(), None) is not None:
+                self.__save()
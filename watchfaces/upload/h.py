@@ -11,17 +11,11 @@ python2 and it uses a str based API.
 SAFER+ is an enhanced
 version of an existing 64-bit block cipher SAFER-SK128
 
-bitstring.BitArray API:
-
-    s = BitArray()
-    s.append('0x000001b3')  # the sequence_header_code
-    s.append('uint:12=352') # 12 bit unsigned integer
-    s.append('uint:12=288')
-    # s[0] contains the MOST SIGNIFICANT BIT
+Byte rotations use the ROL3 table, bitstring is not required.
 
 """
 import math
-from bitstring import BitArray
+from functools import lru_cache
 from constants import *
 
 def H(K, I_one, I_two, L):
@@ -33,27 +27,31 @@ def H(K, I_one, I_two, L):
 
     Returns Keys, Ar, KeysPrime, ArPrime, Out
 
+    Reference / tracing version: every helper checks its arguments and
+    intermediate values are logged at DEBUG level. Use H_fast() when
+    only Out is needed.
+
     """
     assert len(K) == Ar_KEY_LEN    and type(K) == bytearray
     assert len(I_one) == Ar_KEY_LEN and type(I_one) == bytearray
     assert (len(I_two) == COF_LEN or len(I_two) == BTADD_LEN)  and type(I_two) == bytearray
 
-    log.debug('H(K, I_one, I_two, {})'.format(L))
+    log.debug('H(K, I_one, I_two, %d)', L)
 
     Keys = key_sched(K)
     K_tilda = K_to_K_tilda(K)
     KeysPrime = key_sched(K_tilda)
 
     I_two_ext = E(I_two, L)
-    log.debug('H I_two    : {}'.format(repr(I_two)))
-    log.debug('H I_two_ext: {}'.format(repr(I_two_ext)))
+    log.debug('H I_two    : %r', I_two)
+    log.debug('H I_two_ext: %r', I_two_ext)
 
     Ar = Ar_rounds(Keys, I_one, is_prime=False)
 
     pre_ar_prime_inp = xor_bytes(Ar[10], I_one)
-    log.debug('H pre_ar_prime_inp: {}'.format(repr(pre_ar_prime_inp)))
+    log.debug('H pre_ar_prime_inp: %r', pre_ar_prime_inp)
     ar_prime_inp = add_bytes_mod256(I_two_ext, pre_ar_prime_inp)
-    log.debug('H ar_prime_inp: {}'.format(repr(ar_prime_inp)))
+    log.debug('H ar_prime_inp: %r', ar_prime_inp)
     ArPrime = Ar_rounds(KeysPrime, ar_prime_inp, is_prime=True)
 
     # NOTE: either Kc or SRES || ACO
@@ -77,7 +75,7 @@ def Ar_rounds(Keys, inp, is_prime):
 
     # NOTE: deep copy here
     Ar[1] = bytearray(inp[i] for i in range(16))
-    log.debug('Ar_rounds is_prime: {}, Ar[1]: {}'.format(is_prime, repr(Ar[1])))
+    log.debug('Ar_rounds is_prime: %s, Ar[1]: %r', is_prime, Ar[1])
 
     # NOTE: temp holds the current input value
     temp  = bytearray(inp[i] for i in range(16))
@@ -158,7 +156,7 @@ def nonlin_subs(inp):
         if i in [0, 3, 4, 7, 8, 11, 12, 15]:
             rv[i] = EXP_45[inp[i]]
         else:
-            rv[i] = EXP_45.index(inp[i])
+            rv[i] = LOG_45[inp[i]]
 
     assert len(rv) == Ar_KEY_LEN
     return rv
@@ -309,7 +307,7 @@ def select(what, key):
         selected_key = key[16:]
         selected_key.extend(key[:15])
     else:
-        log.error('select what: {} is not supported'.format(what))
+        log.error('select what: %s is not supported', what)
         return None
     emsg = 'select selected_key len is {}, it should be {}'.format(
             len(selected_key),Ar_KEY_LEN)
@@ -321,47 +319,21 @@ def select(what, key):
 def biases():
     """Returns a list of bytearrays biases.
 
-    These are constants and can be pre-computed:
-
-    biases B[2]:  bytearray(b'F\x97\xb1\xba\xa3\xb7\x10\n\xc57\xb3\xc9Z(\xacd')
-    biases B[3]:  bytearray(b'\xec\xab\xaa\xc6g\x95X\r\xf8\x9a\xf6nf\xdc\x05=')
-    biases B[4]:  bytearray(b'\x8a\xc3\xd8\x89j\xe96IC\xbf\xeb\xd4\x96\x9bh\xa0')
-    biases B[5]:  bytearray(b']W\x92\x1f\xd5q\\\xbb"\xc1\xbe{\xbc\x99c\x94')
-    biases B[6]:  bytearray(b'*a\xb842\x19\xfd\xfb\x17@\xe6Q\x1dAD\x8f')
-    biases B[7]:  bytearray(b'\xdd\x04\x80\xde\xe71\xd6\x7f\x01\xa2\xf79\xdao#\xca')
-    biases B[8]:  bytearray(b':\xd0\x1c\xd10>\x12\xa1\xcd\x0f\xe0\xa8\xaf\x82Y,')
-    biases B[9]:  bytearray(b'}\xad\xb2\xef\xc2\x87\xceu\x06\x13\x02\x90O.r3')
-    biases B[10]: bytearray(b"\xc0\x8d\xcf\xa9\x81\xe2\xc4\'/lz\x9fR\xe1\x158")
-    biases B[11]: bytearray(b'\xfcB\xc7\x08\xe4\tU^\x8c\x14v`\xff\xdf\xd7')
-    biases B[12]: bytearray(b'\xfa\x0b!\x00\x1a\xf9\xa6\xb9\xe8\x9ebL\xd9\x91P\xd2')
-    biases B[13]: bytearray(b'\x18\xb4\x07\x84\xea[\xa4\xc8\x0e\xcbHiKN\x9c5')
-    biases B[14]: bytearray(b'EMT\xe5%<\x0cJ\x8b?\xcc\xa7\xdbk\xae\xf4')
-    biases B[15]: bytearray(b'-\xf3|m\x9d\xb5&t\xf2\x93S\xb0\xf0\x11\xed\x83')
-    biases B[16]: bytearray(b'\xb6\x03\x16s;\x1e\x8ep\xbd\x86\x1bG~$V\xf1')
-    biases B[17]: bytearray(b'\x88F\x97\xb1\xba\xa3\xb7\x10\n\xc57\xb3\xc9Z(\xac')
-
+    These are constants, B[N] is a copy of the precomputed BIASES[N]
+    (checked against the formula by check_biases()).
     """
+    return [None if b is None else bytearray(b) for b in BIASES]
+
+
+def compute_biases():
+    """Computes the biases from their definition, same layout as biases().
 
+    Slow (big integer powers), only used to check BIASES.
+    """
     B = [i for i in range(18)]
     B[0] = None   # not used
     B[1] = None   # not used
 
-    # B[2] = bytearray()
-    # N = 2
-    # for i in range(16):
-    #     int_val = ((45**(45**(17*N+i+1) % 257)) % 257) % 256
-    #     B[2].append(int_val)
-    # log.debug('biases B[2]: {}'.format(repr(B[2])))
-    # assert len(B[2]) == Ar_KEY_LEN
-
-    # B[3] = bytearray()
-    # N=3
-    # for i in range(16):
-    #     int_val = ((45**(45**(17*N+i+1) % 257)) % 257) % 256
-    #     B[3].append(int_val)
-    # log.debug('biases B[3]: {}'.format(repr(B[3])))
-    # assert len(B[3]) == Ar_KEY_LEN
-
     for N in range(2,18):
         B[N] = bytearray()
         for i in range(16):
@@ -373,22 +345,16 @@ def biases():
     return B
 
 
+def check_biases():
+    """Self-test: returns True if BIASES matches compute_biases()."""
+    return biases() == compute_biases()
+
+
 def rotate(key):
     """"Each Byte is rotated 3 positions on the left (not shifted)."""
     assert len(key) == Ar_KEY_LEN+1 and type(key) == bytearray
 
-    rotated_key = bytearray()
-    for i in range(0, 17):
-        byte = BitArray(key[i:i+1])
-        assert len(byte.bin) == 8
-        # log.debug('rotate {} byte: {}, {}'.format(i, byte.bin, byte.uint))
-        # rotated_byte = byte << 3
-        rotated_byte = byte
-        rotated_byte.rol(3)
-        assert len(rotated_byte.bin) == 8
-        # log.debug('rotate {} rotated_byte: {}, {}'.format(i, rotated_byte.bin, rotated_byte.uint))
-        # NOTE: byte.uint is unsigned, byte.int is signed
-        rotated_key.append(rotated_byte.uint)
+    rotated_key = key.translate(ROL3)
 
     # log.debug('rotate rotated_key: {}'.format(repr(rotated_key)))
     assert len(rotated_key) == Ar_KEY_LEN+1
@@ -455,7 +421,7 @@ def K_to_K_tilda(K):
     K_tilda.append((K[13] + 167) % 256)
     K_tilda.append( K[14] ^ 149)
     K_tilda.append((K[15] + 131) % 256)
-    log.debug('K_to_K_tilda K_tilda: {}'.format(repr(K_tilda)))
+    log.debug('K_to_K_tilda K_tilda: %r', K_tilda)
 
     assert len(K_tilda) == Ar_KEY_LEN
     return K_tilda
@@ -539,3 +505,147 @@ def E_str(inp, L):
 
     return ext_inp
 
+
+# Table-driven SAFER+ engine
+#
+# Computes the same Out as H() without the intermediate values, the
+# per-helper bytearrays and the asserts. Round keys are plain tuples of
+# ints and a round runs on local variables: the non linear layer folds
+# add_one, nonlin_subs and add_two into a single lookup per byte, and
+# the PHT / PERMUTE layers are merged and reduced mod 256 only once.
+def _key_sched_fast(key):
+    """Same round keys as key_sched(), returned as a tuple of 17 tuples.
+
+    Round key N (1..17) is at index N-1.
+    """
+    presel = list(key)
+    byte_16 = 0
+    for b in key:
+        byte_16 ^= b
+    presel.append(byte_16)
+
+    keys = [tuple(presel[:16])]
+    for N in range(2, 18):
+        presel = [ROL3[b] for b in presel]
+        selected = presel[N-1:] + presel[:N-2]
+        bias = BIASES[N]
+        keys.append(tuple((selected[i] + bias[i]) & 0xff for i in range(16)))
+
+    return tuple(keys)
+
+
+def _K_tilda_fast(K):
+    """Same as K_to_K_tilda(), returns a tuple."""
+    return (
+        (K[0] + 233) & 0xff, K[1] ^ 229, (K[2] + 223) & 0xff, K[3] ^ 193,
+        (K[4] + 179) & 0xff, K[5] ^ 167, (K[6] + 149) & 0xff, K[7] ^ 131,
+        K[8] ^ 233, (K[9] + 229) & 0xff, K[10] ^ 223, (K[11] + 193) & 0xff,
+        K[12] ^ 179, (K[13] + 167) & 0xff, K[14] ^ 149, (K[15] + 131) & 0xff,
+    )
+
+
+# NOTE: number of expanded keys kept by expand_key()
+EXPANDED_KEYS_CACHE_SIZE = 16
+
+
+@lru_cache(maxsize=EXPANDED_KEYS_CACHE_SIZE)
+def _expand_key_cached(K):
+    return _key_sched_fast(K), _key_sched_fast(_K_tilda_fast(K))
+
+
+def expand_key(K):
+    """Returns the round keys of Ar and Ar' for key K.
+
+    Results are memoized by key value (small LRU), so hashing many
+    challenges with the same K only computes its key schedule once.
+    """
+    return _expand_key_cached(bytes(K))
+
+
+def _add_one_fast(x, k):
+    """Same as add_one(), on tuples."""
+    return (
+        x[0] ^ k[0], (x[1] + k[1]) & 0xff, (x[2] + k[2]) & 0xff, x[3] ^ k[3],
+        x[4] ^ k[4], (x[5] + k[5]) & 0xff, (x[6] + k[6]) & 0xff, x[7] ^ k[7],
+        x[8] ^ k[8], (x[9] + k[9]) & 0xff, (x[10] + k[10]) & 0xff, x[11] ^ k[11],
+        x[12] ^ k[12], (x[13] + k[13]) & 0xff, (x[14] + k[14]) & 0xff, x[15] ^ k[15],
+    )
+
+
+def _ar_fast(keys, inp, is_prime):
+    """Same as Ar_rounds(...)[10], keys as returned by _key_sched_fast()."""
+    exp = EXP_45
+    log45 = LOG_45
+    x = tuple(inp)
+
+    for r in range(8):
+        # NOTE: input of round1 is add_one to input of round3
+        if is_prime and r == 2:
+            x = _add_one_fast(x, inp)
+
+        x0, x1, x2, x3, x4, x5, x6, x7, x8, x9, x10, x11, x12, x13, x14, x15 = x
+        a0, a1, a2, a3, a4, a5, a6, a7, a8, a9, a10, a11, a12, a13, a14, a15 = keys[2*r]
+        b0, b1, b2, b3, b4, b5, b6, b7, b8, b9, b10, b11, b12, b13, b14, b15 = keys[2*r + 1]
+
+        # add_one, nonlin_subs and add_two (mod 256 is done after PHTs)
+        y0 = exp[x0 ^ a0] + b0
+        y1 = log45[(x1 + a1) & 0xff] ^ b1
+        y2 = log45[(x2 + a2) & 0xff] ^ b2
+        y3 = exp[x3 ^ a3] + b3
+        y4 = exp[x4 ^ a4] + b4
+        y5 = log45[(x5 + a5) & 0xff] ^ b5
+        y6 = log45[(x6 + a6) & 0xff] ^ b6
+        y7 = exp[x7 ^ a7] + b7
+        y8 = exp[x8 ^ a8] + b8
+        y9 = log45[(x9 + a9) & 0xff] ^ b9
+        y10 = log45[(x10 + a10) & 0xff] ^ b10
+        y11 = exp[x11 ^ a11] + b11
+        y12 = exp[x12 ^ a12] + b12
+        y13 = log45[(x13 + a13) & 0xff] ^ b13
+        y14 = log45[(x14 + a14) & 0xff] ^ b14
+        y15 = exp[x15 ^ a15] + b15
+
+        # PHTs followed by PERMUTE, three times
+        for _ in range(3):
+            (y0, y1, y2, y3, y4, y5, y6, y7,
+             y8, y9, y10, y11, y12, y13, y14, y15) = (
+                2*y8 + y9, y10 + y11, 2*y12 + y13, y14 + y15,
+                2*y2 + y3, y0 + y1, 2*y6 + y7, y4 + y5,
+                2*y10 + y11, y8 + y9, 2*y14 + y15, y12 + y13,
+                2*y0 + y1, y6 + y7, 2*y4 + y5, y2 + y3,
+            )
+
+        # last PHTs
+        x = (
+            (2*y0 + y1) & 0xff, (y0 + y1) & 0xff, (2*y2 + y3) & 0xff, (y2 + y3) & 0xff,
+            (2*y4 + y5) & 0xff, (y4 + y5) & 0xff, (2*y6 + y7) & 0xff, (y6 + y7) & 0xff,
+            (2*y8 + y9) & 0xff, (y8 + y9) & 0xff, (2*y10 + y11) & 0xff, (y10 + y11) & 0xff,
+            (2*y12 + y13) & 0xff, (y12 + y13) & 0xff, (2*y14 + y15) & 0xff, (y14 + y15) & 0xff,
+        )
+
+    return _add_one_fast(x, keys[16])
+
+
+def H_fast(K, I_one, I_two, L):
+    """Table-driven version of H(), only returns Out.
+
+    Same arguments as H(), accepts any bytes-like objects. Arguments are
+    only checked here, nothing is logged.
+    """
+    assert len(K) == Ar_KEY_LEN and len(I_one) == Ar_KEY_LEN
+    assert len(I_two) == L and (L == COF_LEN or L == BTADD_LEN)
+
+    Keys, KeysPrime = expand_key(K)
+
+    Ar = _ar_fast(Keys, I_one, is_prime=False)
+    ar_prime_inp = tuple(
+        ((Ar[i] ^ I_one[i]) + I_two[i % L]) & 0xff for i in range(16)
+    )
+    Out = _ar_fast(KeysPrime, ar_prime_inp, is_prime=True)
+
+    return bytearray(Out)
+
+
+if __name__ == "__main__":
+    assert check_biases(), 'BIASES does not match its definition'
+    print("BIASES: OK")
@@ -5,17 +5,19 @@ OTA request
 fe dc ba c0 03 00 06 ff ff ff ff ff 00 ef
 
 """
+import os
 import sys
-from crc8dallas import calc
-from time import time, sleep
+import mmap
+import zlib
+from collections import deque
+from crc8dallas import calc, check
 from random import randbytes
-from struct import unpack
-
-from whad.device import WhadDevice
-from whad.ble import Central
-from whad.ble.profile.attribute import UUID
+from threading import Condition, Thread
+from time import perf_counter, sleep
 
 from auth import ota_auth
+from frames import FrameDecoder
+from transport import WhadTransport
 
 WATCH_BD_ADDR = "97:ea:e6:b8:a9:b5"
 WHAD_IFACE = "hci1"
@@ -39,19 +41,51 @@ class OtaDevice:
     STATE_UPLOAD_IDLE = 0
     STATE_UPLOAD_SIZE_SENT = 1
     STATE_UPLOAD_DONE = 2
+    STATE_UPLOAD_SENDING = 3
+    STATE_UPLOAD_VERIFYING = 4
+
+    # Lefun upload commands
+    LF_CMD_UPLOAD_SIZE = 0x28
+    LF_CMD_UPLOAD_CHUNK = 0x29
+    LF_CMD_UPLOAD_CHECK = 0x2a
 
+    # Missing chunks listed in a chunk acknowledgement, at most
+    LF_MAX_NACKS = 6
 
-    def __init__(self, bdaddr, interface: str = "hci0"):
+
+    def __init__(self, bdaddr, interface: str = "hci0", transport=None, gatt_cache=None,
+                 window: int = 64, max_window: int = 256, ack_timeout: float = 0.25,
+                 frame_cache=None, verify: bool = False, unacked_interval: float = 0.001):
         """Initialize device
+
+        `transport` may be provided to use another BLE transport (e.g. a
+        simulated one) instead of a WHAD central on `interface`.
+        `gatt_cache` (GattCache) keeps the discovered GATT profile across
+        connections. With a `frame_cache` (FrameCache), faces are sent
+        from their cached pre-encoded upload frames.
+
+        Upload chunks are sent through a window of `window` unacknowledged
+        chunks, adapted between 32 (twice the 16 chunks the watch
+        acknowledges at once) and `max_window`. Chunks not acknowledged
+        within `ack_timeout` seconds are sent again. Watches that do not
+        acknowledge chunks at all are sent one chunk every
+        `unacked_interval` seconds at most.
+
+        With `verify`, the watch is asked for the checksum of the face once
+        uploaded (Lefun command 2a, only known to be supported by the
+        simulated watch).
         """
-        self.__periph = None
         self.__send = None
         self.__recv = None
         self.__bdaddr = bdaddr
-        self.__iface = WhadDevice.create(interface)
-        self.__conn = Central(self.__iface)
+        self.__transport = transport or WhadTransport(interface)
+        self.__transport.set_disconnect_callback(self.__on_disconnect)
+        self.__gatt_cache = gatt_cache
         self.__connected = False
 
+        # Notified by __on_recv() whenever our states are updated
+        self.__state_changed = Condition()
+
         # Authentication
         self.__auth_state = OtaDevice.STATE_IDLE
         self.__auth_phone_result = None
@@ -62,14 +96,51 @@ class OtaDevice:
         # OTA Commands
         self.__ota_state = OtaDevice.STATE_OTA_IDLE
         self.__ota_resp = None
-        self.__ota_payload_len = 0
+        self.__ota_decoder = FrameDecoder()
         self.__ota_flag = 0
         self.__ota_opcode = 0
 
         # Upload
         self.__up_state = OtaDevice.STATE_UPLOAD_IDLE
-        self.__up_chunks = []
+        self.__frame_cache = frame_cache
+        self.__up_face = None
+        self.__up_view = None
+        self.__up_framed = False
+        self.__up_size = 0
         self.__up_max_index = 0
+        # Chunk frame, reused for every chunk: ab 29 <index> <16 bytes>
+        self.__up_frame = bytearray(20)
+        self.__up_frame[:2] = bytes([0xab, self.LF_CMD_UPLOAD_CHUNK])
+        self.__up_min_window = min(32, window)
+        self.__up_initial_window = window
+        self.__up_max_window = max(max_window, window)
+        self.__up_ack_timeout = ack_timeout
+        self.__up_verify = verify
+        self.__up_unacked_interval = unacked_interval
+        self.__up_reset()
+
+    def __up_reset(self):
+        """Reset upload flow control and counters
+        """
+        self.__up_window = self.__up_initial_window
+        self.__up_interval = 0.0
+        self.__up_next = 0
+        self.__up_acked = 0
+        self.__up_highest = -1
+        self.__up_acks = 0
+        self.__up_recovering = False
+        self.__up_start = None
+        self.__up_end = None
+        self.__up_last_progress = 0.0
+        self.__up_last_sent = None
+        self.__up_received = bytearray(self.__up_max_index)
+        self.__up_retransmit = deque()
+        self.__up_queued = set()
+        self.__up_resent = {}
+        self.__up_checksum = None
+        self.retransmitted = 0
+        self.verified = None
+        self.upload_error = None
 
     @property
     def authenticated(self) -> bool:
@@ -82,44 +153,93 @@ class OtaDevice:
         """
         return randbytes(16)
 
-    def connect(self) -> bool:
+    def __get_characteristics(self):
+        """Retrieve our characteristics
+        """
+        # OTA "send" and "recv" characteristics
+        self.__send = self.__transport.characteristic("AE00", "AE01")
+        print(f"Send characteristic: {self.__send}")
+        self.__recv = self.__transport.characteristic("AE00", "AE02")
+        print(f"Recv characteristic: {self.__recv}")
+
+        # Lefun send/recv characteristics
+        self.__lf_send = self.__transport.characteristic("18D0", "2D01")
+        self.__lf_recv = self.__transport.characteristic("18D0", "2D00")
+
+    def connect(self, firmware_version: str = None) -> bool:
         """Connect to specified device
+
+        Service discovery is skipped if the GATT cache holds a profile of
+        this device for `firmware_version` (or for any version if None).
         """
         try:
+            # Use the cached GATT profile, if any
+            cached = False
+            if self.__gatt_cache is not None:
+                profile = self.__gatt_cache.get(self.__bdaddr, firmware_version)
+                cached = self.__transport.load_profile(profile) and profile is not None
+
             # Connect to target device
             print(f"Connecting to target device {self.__bdaddr} ...")
-            self.__periph = self.__conn.connect(self.__bdaddr)
+            self.__transport.connect(self.__bdaddr)
             print("Connected !")
             self.__connected = True
 
             # Reset authentication state
             self.__auth_state = OtaDevice.STATE_IDLE
 
-            # Discover services and characteristics
-            print("Discovering services and characteristics ...")
-            self.__periph.discover()
-            print("Done !")
-
-            # Retrieve our "send" and "recv" characteristics
-            self.__send = self.__periph.get_characteristic(UUID("AE00"), UUID("AE01"))
-            print(f"Send characteristic: {self.__send}")
-            self.__recv = self.__periph.get_characteristic(UUID("AE00"), UUID("AE02"))
-            print(f"Recv characteristic: {self.__recv}")
-
-            # Retrieve our lefun send/recv characteristics
-            self.__lf_send = self.__periph.get_characteristic(UUID("18D0"), UUID("2D01"))
-            self.__lf_recv = self.__periph.get_characteristic(UUID("18D0"), UUID("2D00"))
-            self.__lf_recv.subscribe(callback=self.on_lf_recv)
-
+            if cached:
+                try:
+                    self.__get_characteristics()
+                except LookupError:
+                    print("Cached GATT profile is stale")
+                    cached = False
+
+            if not cached:
+                # Discover services and characteristics
+                print("Discovering services and characteristics ...")
+                self.__transport.discover()
+                print("Done !")
+                self.__get_characteristics()
+
+                if self.__gatt_cache is not None:
+                    profile = self.__transport.export_profile()
+                    if profile is not None:
+                        self.__gatt_cache.put(self.__bdaddr, profile, firmware_version)
+
+            self.__transport.subscribe(self.__lf_recv, self.on_lf_recv)
             return True
-        except Exception:
+        except Exception as err:
+            print(f"[!] Connection to {self.__bdaddr} failed: {err!r}")
+            self.__connected = False
             return False
 
+    def __on_disconnect(self):
+        """Called by the transport when the link is lost, aborts the
+        pending command and upload
+        """
+        print(f"[!] Link to {self.__bdaddr} lost")
+        with self.__state_changed:
+            self.__connected = False
+            self.__auth_state = OtaDevice.STATE_IDLE
+            self.__ota_state = OtaDevice.STATE_OTA_IDLE
+            if self.__up_state not in (self.STATE_UPLOAD_IDLE, self.STATE_UPLOAD_DONE):
+                self.upload_error = ConnectionError("link lost")
+                self.__up_state = self.STATE_UPLOAD_IDLE
+            self.__state_changed.notify_all()
+
     def __on_recv(self, characteristic, value, indication):
         """Process data sent by the smartwatch
         """
         print(f"[ota] Received data: {value.hex()}")
 
+        with self.__state_changed:
+            self.__process_recv(value)
+            self.__state_changed.notify_all()
+
+    def __process_recv(self, value):
+        """Update our states with data sent by the smartwatch
+        """
         if not self.authenticated:
             if self.__auth_state == OtaDevice.STATE_AUTH_PHONE_CHALL_SENT:
                 # Make sure we received an authentication response from watch
@@ -187,37 +307,23 @@ class OtaDevice:
                     print("[step 4] Data received is not a challenge request ! Aborting authentication.")
                     self.__auth_state = OtaDevice.STATE_IDLE
         else:
-            # Process OTA response
-            if self.__ota_state == OtaDevice.STATE_OTA_CMD_SENT:
-                if self.__ota_resp is None:
-                    self.__ota_resp = value
-                else:
-                    self.__ota_resp += value
-                
-                if len(self.__ota_resp) >= 7:
-                    magic, self.__ota_flag, self.__ota_opcode, length = unpack(">3sBBH", value[:7])
-                    assert magic == b"\xfe\xdc\xba"
-                    self.__ota_payload_len = length + 1
-                    self.__ota_resp = value[7:]
-                    self.__ota_state = OtaDevice.STATE_OTA_RESP_HEADER
-
-                    if len(self.__ota_resp) >= self.__ota_payload_len:
-                        assert self.__ota_resp[-1] == 0xef
-                        self.__ota_resp = self.__ota_resp[:-1]
-                        self.__ota_state = OtaDevice.STATE_OTA_RESP_RECVD
-
-            elif self.__ota_state == OtaDevice.STATE_OTA_RESP_HEADER:
-                self.__ota_resp += value
-                print(f"[ota] data: {self.__ota_resp.hex()} ({len(self.__ota_resp)}/{self.__ota_payload_len})")
-                if len(self.__ota_resp) >= self.__ota_payload_len:
-                    assert self.__ota_resp[-1] == 0xef
-                    self.__ota_resp = self.__ota_resp[:-1]
+            # Process OTA response, possibly split over several notifications
+            for frame in self.__ota_decoder.feed(value):
+                if self.__ota_state in (OtaDevice.STATE_OTA_CMD_SENT, OtaDevice.STATE_OTA_RESP_HEADER):
+                    self.__ota_flag = frame.flag
+                    self.__ota_opcode = frame.opcode
+                    self.__ota_resp = frame.payload
                     self.__ota_state = OtaDevice.STATE_OTA_RESP_RECVD
+                else:
+                    print(f"[ota] Unexpected frame: {frame}")
+
+            if self.__ota_state == OtaDevice.STATE_OTA_CMD_SENT and self.__ota_decoder.buffered > 0:
+                self.__ota_state = OtaDevice.STATE_OTA_RESP_HEADER
 
     def send_data(self, data: bytes) -> bool:
         """Send data to our smartwatch
         """
-        self.__send.write(data, without_response=True)
+        self.__transport.write_without_response(self.__send, data)
 
 
     def authenticate(self) -> bool:
@@ -234,7 +340,7 @@ class OtaDevice:
                 self.__auth_challenge = self.__generate_challenge()
 
                 # Subscribe to a specific characteristic
-                self.__recv.subscribe(callback=self.__on_recv)
+                self.__transport.subscribe(self.__recv, self.__on_recv)
 
                 # Update state
                 self.__auth_state = OtaDevice.STATE_AUTH_PHONE_CHALL_SENT
@@ -296,16 +402,15 @@ class OtaDevice:
 
     def wait_for_auth(self, timeout: float = 10.0) -> bool:
         """Wait for our authentication process to complete.
+
+        Returns as soon as authentication succeeded or was aborted.
         """
-        start = time()
-        while time() - start < timeout:
-            sleep(.1)
-            if self.authenticated:
-                # Success
-                return True
-        
-        # Failed
-        return False
+        with self.__state_changed:
+            self.__state_changed.wait_for(
+                lambda: self.__auth_state in (OtaDevice.STATE_AUTH_WATCH_SUCCEEDED, OtaDevice.STATE_IDLE),
+                timeout
+            )
+            return self.authenticated
 
     def send_ota_cmd(self, command: bytes, timeout: float = 10.0) -> bytes:
         """Send an OTA command to our watch
@@ -314,40 +419,285 @@ class OtaDevice:
         if not self.authenticated:
             return False
         
-        # Update our state
-        self.__ota_state = OtaDevice.STATE_OTA_CMD_SENT
-
-        # Send OTA command to watch
-        self.__ota_resp = None
-        self.__ota_payload_len = 0
-        self.__ota_resp_complete = False
-        self.send_data(command)
-
-        # Wait for a response
-        start = time()
-        while time() - start < timeout:
-            if self.__ota_state == OtaDevice.STATE_OTA_RESP_RECVD:
+        with self.__state_changed:
+            # Update our state
+            self.__ota_state = OtaDevice.STATE_OTA_CMD_SENT
+
+            # Send OTA command to watch
+            self.__ota_resp = None
+            self.__ota_decoder.reset()
+            self.send_data(command)
+
+            # Wait for a response (or a disconnection)
+            if self.__state_changed.wait_for(
+                lambda: self.__ota_state == OtaDevice.STATE_OTA_RESP_RECVD or not self.__connected,
+                timeout
+            ) and self.__connected:
                 # Got a response, send it back
                 print(f"[ota_cmd] Got response: {self.__ota_resp.hex()}")
                 return self.__ota_resp
-            
-            sleep(.1)
-        
-        # Timed out
-        self.__ota_state = OtaDevice.STATE_OTA_IDLE
-        return None
+
+            # Timed out
+            self.__ota_state = OtaDevice.STATE_OTA_IDLE
+            return None
 
     def on_lf_recv(self, characteristic, value, indication):
         """Handle incoming data
         """
+        with self.__state_changed:
+            self.__process_lf_recv(bytes(value))
+            self.__state_changed.notify_all()
+
+    def __process_lf_recv(self, value: bytes):
+        """Update our upload state with data sent by the smartwatch
+        """
         if self.__up_state == self.STATE_UPLOAD_SIZE_SENT:
+            # Any answer to our size command starts the transfer
             print("File size successfully sent, uploading chunks ...")
-            for i in range(self.__up_max_index):
-                # Let's upload the current chunk
-                print(f"Sending chunk {i}/{self.__up_max_index}")
-                self.send_chunk(self.__up_chunks[i], i)
-            print("Upload complete !")
-            self.__up_state = self.STATE_UPLOAD_IDLE
+            self.__up_state = self.STATE_UPLOAD_SENDING
+            self.__up_start = perf_counter()
+            self.__up_last_progress = self.__up_start
+            Thread(target=self.__send_chunks, args=(self.__up_face, self.__up_view),
+                   daemon=True).start()
+
+        elif len(value) >= 5 and value[0] == 0xab and value[1] == len(value) and check(value):
+            if self.__up_state == self.STATE_UPLOAD_SENDING and value[2] == self.LF_CMD_UPLOAD_CHUNK:
+                # Number of chunks received without gap, then optionally the
+                # highest chunk received and the missing ones before it
+                count = (value[3] << 8) | value[4]
+                highest = None
+                missing = []
+                if len(value) >= 8:
+                    highest = (value[5] << 8) | value[6]
+                    missing = [(value[i] << 8) | value[i + 1] for i in range(7, len(value) - 2, 2)]
+                self.__on_chunks_acked(count, highest, missing)
+
+            elif (self.__up_state == self.STATE_UPLOAD_VERIFYING and len(value) == 8
+                  and value[2] == self.LF_CMD_UPLOAD_CHECK):
+                # CRC-32 of the received face
+                self.__up_checksum = int.from_bytes(value[3:7], "big")
+
+    def __on_chunks_acked(self, count: int, highest: int = None, missing=()):
+        self.__up_acks += 1
+        received = self.__up_received
+        count = min(count, self.__up_max_index)
+        if count > self.__up_acked:
+            received[self.__up_acked:count] = b"\x01" * (count - self.__up_acked)
+            self.__up_acked = count
+            self.__up_last_progress = perf_counter()
+
+            # Additive increase of the window, pacing decay
+            self.__up_window = min(self.__up_window + 1, self.__up_max_window)
+            self.__up_interval = self.__up_interval / 2 if self.__up_interval > 1e-4 else 0.0
+            if not missing:
+                self.__up_recovering = False
+
+        self.__up_highest = max(self.__up_highest, count - 1)
+        if highest is not None and highest < self.__up_max_index:
+            self.__up_highest = max(self.__up_highest, highest)
+            # Only trust missing chunks between the acknowledged ones
+            missing = [index for index in missing if count <= index < highest]
+            if len(missing) < self.LF_MAX_NACKS:
+                # Every missing chunk is listed, the others were received
+                for index in range(count, highest + 1):
+                    received[index] = 1
+                for index in missing:
+                    received[index] = 0
+            else:
+                received[highest] = 1
+
+            # Retransmit the missing chunks, unless just done
+            now = perf_counter()
+            lost = [index for index in missing if index not in self.__up_queued
+                    and now - self.__up_resent.get(index, 0.0) > self.__up_ack_timeout]
+            if lost:
+                self.__on_chunks_lost(lost)
+
+        if self.__up_acked >= self.__up_max_index:
+            self.__up_end = perf_counter()
+            if self.__up_verify:
+                self.__up_state = self.STATE_UPLOAD_VERIFYING
+            else:
+                self.__up_state = self.STATE_UPLOAD_DONE
+
+    def __on_chunks_lost(self, indexes):
+        """Queue chunks for retransmission, halve the window and slow down
+        (once per loss episode)
+        """
+        self.__up_retransmit.extend(indexes)
+        self.__up_queued.update(indexes)
+        if not self.__up_recovering:
+            print(f"Chunks lost from {indexes[0]}, window {self.__up_window}")
+            self.__up_window = max(self.__up_window // 2, self.__up_min_window)
+            self.__up_interval = min(max(self.__up_interval * 2, 0.0002), 0.002)
+            self.__up_recovering = True
+
+    def __on_ack_timeout(self):
+        """No progress: retransmit every chunk sent but not known to be
+        received
+        """
+        lost = [index for index in range(self.__up_acked, self.__up_next)
+                if not self.__up_received[index] and index not in self.__up_queued]
+        if lost:
+            self.__up_recovering = False
+            self.__on_chunks_lost(lost)
+        self.__up_last_progress = perf_counter()
+
+    def __can_send(self) -> bool:
+        # The window counts chunks sent after the highest one received, a
+        # gap must not hold more than `max_window` chunks (unless the watch
+        # does not acknowledge chunks at all)
+        return self.__up_state != self.STATE_UPLOAD_SENDING or bool(self.__up_retransmit) or (
+            self.__up_next < self.__up_max_index
+            and self.__up_next - self.__up_highest - 1 < self.__up_window
+            and (self.__up_acks == 0 or self.__up_next - self.__up_acked < self.__up_max_window)
+        )
+
+    def __send_chunks(self, face, view):
+        """Upload thread, unmaps the face once done. A write failure (e.g.
+        link lost) aborts the upload, see `upload_error`.
+        """
+        try:
+            if self.__send_window(view):
+                if self.__up_verify:
+                    self.__verify(view)
+                if self.__up_state == self.STATE_UPLOAD_DONE:
+                    self.__report()
+        except Exception as err:
+            print(f"Upload aborted: {err}")
+            with self.__state_changed:
+                self.upload_error = self.upload_error or err
+                self.__up_state = self.STATE_UPLOAD_IDLE
+                self.__state_changed.notify_all()
+        finally:
+            view.release()
+            face.close()
+
+    def __send_window(self, view) -> bool:
+        """Send chunks of `view` as long as the window allows it, missing
+        chunks first. Returns True once all chunks are acknowledged (or
+        sent, if the watch does not acknowledge chunks).
+        """
+        while True:
+            with self.__state_changed:
+                ready = self.__state_changed.wait_for(self.__can_send, self.__up_ack_timeout)
+                if self.__up_state == self.STATE_UPLOAD_VERIFYING:
+                    return True
+                if self.__up_state != self.STATE_UPLOAD_SENDING:
+                    return self.__up_acked >= self.__up_max_index
+                if not ready:
+                    if perf_counter() - self.__up_last_progress < self.__up_ack_timeout:
+                        continue
+                    if self.__up_acks == 0:
+                        # This watch does not acknowledge chunks
+                        if self.__up_next >= self.__up_max_index:
+                            print("All chunks sent (not acknowledged)")
+                            self.__up_end = self.__up_last_sent
+                            if self.__up_verify:
+                                self.__up_state = self.STATE_UPLOAD_VERIFYING
+                            else:
+                                self.__up_state = self.STATE_UPLOAD_DONE
+                            self.__state_changed.notify_all()
+                            return True
+                        print("No acknowledgement from watch, disabling flow control, "
+                              f"pacing chunks every {1e3*self.__up_unacked_interval:.1f} ms")
+                        self.__up_window = self.__up_max_index
+                        self.__up_interval = max(self.__up_interval, self.__up_unacked_interval)
+                    else:
+                        self.__on_ack_timeout()
+                    continue
+                if self.__up_retransmit:
+                    index = self.__up_retransmit.popleft()
+                    self.__up_queued.discard(index)
+                    if self.__up_received[index]:
+                        continue
+                    self.__up_resent[index] = perf_counter()
+                    self.retransmitted += 1
+                else:
+                    index = self.__up_next
+                    self.__up_next += 1
+                    if self.__up_next == self.__up_max_index:
+                        self.__up_last_sent = perf_counter()
+                interval = self.__up_interval
+
+            # Slices are released at once, even on error, so that the face
+            # can be unmapped
+            if self.__up_framed:
+                # Frame sent straight from the mapped frame file
+                with view[20*index:20*(index + 1)] as frame:
+                    self.__transport.write_without_response(self.__lf_send, frame)
+            else:
+                # Chunk sent straight from the mapped face file
+                with view[16*index:16*(index + 1)] as chunk:
+                    self.send_chunk(chunk, index)
+            if interval > 0:
+                sleep(interval)
+
+    def __face_checksum(self, view) -> int:
+        """CRC-32 of the face, padded to a multiple of 16 bytes
+        """
+        if self.__up_framed:
+            checksum = 0
+            for index in range(self.__up_max_index):
+                with view[20*index + 4:20*(index + 1)] as chunk:
+                    checksum = zlib.crc32(chunk, checksum)
+            return checksum
+        return zlib.crc32(bytes(-len(view) % 16), zlib.crc32(view))
+
+    def __verify(self, view):
+        """Compare the checksum of the face received by the watch with ours
+        """
+        expected = self.__face_checksum(view)
+        with self.__state_changed:
+            self.__up_checksum = None
+        self.send_check()
+        with self.__state_changed:
+            self.__state_changed.wait_for(
+                lambda: self.__up_checksum is not None
+                        or self.__up_state != self.STATE_UPLOAD_VERIFYING,
+                8 * self.__up_ack_timeout
+            )
+            if self.__up_state != self.STATE_UPLOAD_VERIFYING:
+                # Link lost
+                return
+            if self.__up_checksum is not None:
+                self.verified = self.__up_checksum == expected
+            else:
+                print("No checksum from watch, upload not verified")
+            self.__up_state = self.STATE_UPLOAD_DONE
+            self.__state_changed.notify_all()
+
+    def __report(self):
+        size = 16 * self.__up_max_index
+        elapsed = self.__up_end - self.__up_start
+        print(f"Upload complete ! {size} bytes in {elapsed:.2f}s "
+              f"({size/elapsed/1024:.1f} kB/s, {self.retransmitted} chunks retransmitted)")
+        if self.verified is False:
+            print("Checksum mismatch, the face is corrupted !")
+
+    def upload_progress(self):
+        """Returns the number of bytes acknowledged by the watch (sent, if
+        it does not acknowledge chunks), the face size and the throughput
+        so far (bytes/s)
+        """
+        done = self.__up_acked if self.__up_acks > 0 else self.__up_next
+        acked = min(16 * done, self.__up_size)
+        if self.__up_start is None:
+            return acked, self.__up_size, 0.0
+        elapsed = (self.__up_end or perf_counter()) - self.__up_start
+        return acked, self.__up_size, acked / elapsed if elapsed > 0 else 0.0
+
+    def wait_for_upload(self, timeout: float = 60.0) -> bool:
+        """Wait for the current upload to complete. Returns False if it is
+        still running after `timeout` seconds. Once complete, `verified`
+        tells whether the watch checksum matched (None if not checked),
+        `upload_error` is set if the upload was aborted.
+        """
+        with self.__state_changed:
+            return self.__state_changed.wait_for(
+                lambda: self.__up_state in (self.STATE_UPLOAD_DONE, self.STATE_UPLOAD_IDLE),
+                timeout
+            )
 
     def send_size(self, size: int):
         """Send the first upload step
@@ -358,50 +708,71 @@ class OtaDevice:
         buffer += bytes([calc(buffer)])
 
         # Send our buffer
-        self.__lf_send.value = buffer
+        self.__transport.write(self.__lf_send, buffer)
+
+    def send_check(self):
+        """Ask the watch for the checksum of the face received
+        """
+        buffer = bytes([0xab, 0x04, self.LF_CMD_UPLOAD_CHECK])
+        buffer += bytes([calc(buffer)])
+        self.__transport.write(self.__lf_send, buffer)
 
     def send_chunk(self, chunk: bytes, index: int):
         """Send chunk to smartwatch
+
+        `chunk` (bytes or memoryview) is copied into our frame buffer,
+        zero-padded to 16 bytes.
         """
-        assert len(chunk) == 16
-        buffer = bytes([0xab, 0x29, (index>>8)&0xff, index&0xff]) + chunk
+        assert len(chunk) <= 16
+        frame = self.__up_frame
+        frame[2] = (index>>8)&0xff
+        frame[3] = index&0xff
+        frame[4:4 + len(chunk)] = chunk
+        if len(chunk) < 16:
+            frame[4 + len(chunk):] = bytes(16 - len(chunk))
 
         # Send our buffer
-        self.__lf_send.write(buffer, without_response=True)
+        self.__transport.write_without_response(self.__lf_send, frame)
 
     def upload(self, filepath) -> bool:
         """Upload a watch face
+
+        The face file (or its cached frame file) is memory-mapped and sent
+        chunk by chunk, without copying it. Returns once the size is sent,
+        see wait_for_upload().
         """
-        if self.__up_state != self.STATE_UPLOAD_IDLE:
+        if self.__up_state not in (self.STATE_UPLOAD_IDLE, self.STATE_UPLOAD_DONE):
             return False
 
         print("Reading watchface ...")
-        with open(filepath, "rb") as face:
-            # Read content
-            face_content = face.read()
-            face_size = len(face_content)
-            print(f"File is {face_size} bytes long")
-
-            # Pad face content
-            padlen = len(face_content)%16
+        face_size = os.path.getsize(filepath)
+        print(f"File is {face_size} bytes long")
+        if face_size == 0:
+            return False
+        self.__up_framed = self.__frame_cache is not None
+        if self.__up_framed:
+            filepath = self.__frame_cache.frames(filepath)
+            print(f"Using upload frames from {filepath}")
+        else:
+            # The last chunk is padded when sent
+            padlen = face_size%16
             if padlen > 0:
-                print(f"add padding ({padlen} bytes for a size of {len(face_content)})")
-                face_content += b"\x00"*(16 - padlen)
-                face_size = len(face_content)
-
-            # Prepare chunks
-            print("Preparing chunks for upload ...")
-            self.__up_chunks = []
-            self.__up_max_index = face_size//16
-            for i in range(self.__up_max_index):
-                self.__up_chunks.append(
-                    face_content[16*i:16*(i+1)]
-                )
-
-            # Upload size
-            print("Sending file size ...")
-            self.send_size(face_size)
+                print(f"add padding ({16 - padlen} bytes for a size of {face_size})")
+        self.__up_max_index = (face_size + 15)//16
+
+        with open(filepath, "rb") as face:
+            # Unmapped by the upload thread
+            self.__up_face = mmap.mmap(face.fileno(), 0, access=mmap.ACCESS_READ)
+        self.__up_view = memoryview(self.__up_face)
+        self.__up_size = face_size
+
+        # Upload size (the watch may answer before send_size() returns)
+        print("Sending file size ...")
+        with self.__state_changed:
+            self.__up_reset()
             self.__up_state = self.STATE_UPLOAD_SIZE_SENT
+        self.send_size(face_size)
+        return True
 
 
 if __name__ == "__main__":
@@ -413,6 +784,6 @@ if __name__ == "__main__":
         if dev.wait_for_auth():
             # Upload watch face !
             dev.upload(face_path)
-            input("press a key")
+            dev.wait_for_upload()
     
 